@@ -1,40 +1,66 @@
 """
 Backpack module for carrying items.
 """
+from array import array
 
+from history import Tracked, delete, insert
+from registry import ITEMS
 
-class Backpack:
+
+class Backpack(Tracked):
     """
     A class to allow us to pickup and put down items...
     Backpack is limited to number of items set by capacity.
     This example incorporates a user defined exception.
+    The items are changed through history's insert and delete, so changes can be undone.
     """
 
     def __init__(self, capacity):
-        self.contents = []
+        self.item_ids = array("H")
         self.capacity = capacity
+        self.capabilities = 0    #one bit for every kind of item carried
+
+    @property
+    def contents(self):
+        """The names of the items in our backpack, as a new list that does not change the backpack."""
+        return [ITEMS.name(item_id) for item_id in self.item_ids]
 
     def add_item(self, item):
         """Adds an item to our backpack."""
-        if len(self.contents) < self.capacity:
-            self.contents.append(item)
+        return self.add_item_id(ITEMS.intern(item))
+
+    def add_item_id(self, item_id):
+        """Adds an item to our backpack by its ID."""
+        if len(self.item_ids) < self.capacity:
+            insert(self.item_ids, len(self.item_ids), item_id)
+            self.capabilities |= 1 << item_id
             return True
         return False
 
     def remove_item(self, item):
         """Removes an item from our backpack."""
         try:
-            if item not in self.contents:
+            if not self.check_item(item):
                 raise NotInBackpackError(item, 'is not in the backpack.')
-            self.contents.remove(item)
+            self.discard_item_id(ITEMS.lookup(item))
         except NotInBackpackError:
             print('Exception handled here...')
         finally:
             print('Carrying on...')
 
+    def discard_item_id(self, item_id):
+        """Removes one item by its ID, returning False if it is not carried."""
+        if not self.capabilities & 1 << item_id:
+            return False
+        delete(self.item_ids, self.item_ids.index(item_id))
+        if item_id not in self.item_ids:
+            self.capabilities &= ~(1 << item_id)
+        return True
+
     def check_item(self, item):
         """Returns True if item is in backpack, False otherwise."""
-        return item in self.contents
+        item_id = ITEMS.lookup(item)
+        return item_id is not None and bool(self.capabilities & 1 << item_id)
 
 
 class NotInBackpackError(Exception):
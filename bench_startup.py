@@ -0,0 +1,71 @@
+"""
+Startup benchmark: how long the interactive game takes to reach its first
+prompt, and how long bulk Game construction takes, with and without the
+precompiled world image.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from game import Game
+from text_ui import ScriptedUI
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+ENTRY_POINTS = {
+    "main() building rooms": "import game; game.main()",
+    "Game(cold_start=True).play() with world image": "import game; game.Game(cold_start=True).play()",
+}
+
+
+def time_entry_point(code, runs):
+    """
+    Starts the game in a new interpreter and quits at the first prompt.
+    :param code: The Python code that starts the game
+    :param runs: How many times to start it
+    :return: The median time in seconds
+    """
+    times = []
+    with tempfile.TemporaryDirectory() as directory:
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", f"import sys; sys.path.insert(0, {DIRECTORY!r}); {code}"],
+                           input=b"quit\n", stdout=subprocess.DEVNULL, cwd=directory, check=True)
+            times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def time_construction(games, cold_start):
+    """
+    Builds many games in this process.
+    :param games: How many to build
+    :param cold_start: Whether to load the world image
+    :return: The time per game in seconds
+    """
+    Game(ScriptedUI(), log_file=None, cold_start=cold_start)
+    start = time.perf_counter()
+    for _ in range(games):
+        Game(ScriptedUI(), log_file=None, cold_start=cold_start)
+    return (time.perf_counter() - start) / games
+
+
+def main():
+    """Prints startup times."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--runs", type=int, default=10, help="interpreter starts per entry point")
+    parser.add_argument("--games", type=int, default=5000, help="games to build in bulk")
+    args = parser.parse_args()
+
+    for label, code in ENTRY_POINTS.items():
+        print(f"{label}: {time_entry_point(code, args.runs) * 1000:.1f} ms to first prompt")
+    for cold_start in (True, False):
+        label = "with world image" if cold_start else "building rooms"
+        print(f"Game() {label}: {time_construction(args.games, cold_start) * 1e6:.0f} us per game")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Turn-based combat engine shared by every fight in the game.
+"""
+import random
+
+from registry import ITEMS, item_mask
+
+ATTACK = "attack"
+HEAL = "heal"
+
+# Healing items in the order they are used, with the health each restores
+HEALING_ITEMS = [(ITEMS.intern("health drink"), 30), (ITEMS.intern("health bag"), 50)]
+HEALING_MASK = item_mask(item_id for item_id, amount in HEALING_ITEMS)
+
+
+def attack_policy(player, enemies):
+    """A policy that always attacks."""
+    return ATTACK
+
+
+def cautious_policy(player, enemies):
+    """A policy that heals when health is low and healing is carried, and attacks otherwise."""
+    if player.health * 3 < player.max_health and player.backpack.capabilities & HEALING_MASK:
+        return HEAL
+    return ATTACK
+
+
+class CombatResult:
+    """The outcome of an encounter."""
+    __slots__ = ("won", "defeated", "turns")
+
+    def __init__(self, won, defeated, turns):
+        self.won = won
+        self.defeated = defeated
+        self.turns = turns
+
+
+class CombatEngine:
+    """
+    This class resolves an encounter between the player and any number of enemies.
+    Each turn the player acts against the first enemy still standing, then every
+    enemy left strikes back. Enemies need name, health, max_health, hit_damage,
+    take_damage(), is_alive(), attack_damage(rng) and describe_attack(damage).
+    Without a ui or log the engine runs headless, which is what simulations use.
+    """
+
+    def __init__(self, ui=None, log=None, rng=random):
+        """
+        :param ui: The TextUI to report the fight on, or None
+        :param log: A function that writes a log message, or None
+        :param rng: The random number generator enemies roll damage with
+        """
+        self.ui = ui
+        self.log = log
+        self.rng = rng
+
+    def resolve(self, player, enemies, policy):
+        """
+        Fights until the player or every enemy is defeated.
+        :param player: The player
+        :param enemies: The enemies in the encounter
+        :param policy: A function (player, enemies) -> "attack" or "heal"
+        :return: A CombatResult
+        """
+        ui, log, rng = self.ui, self.log, self.rng
+        standing = [enemy for enemy in enemies if enemy.is_alive()]
+        defeated = []
+        turns = 0
+        while standing and player.health > 0:
+            turns += 1
+            if ui is not None:
+                ui.print(health_bar("Knight", player.health, player.max_health))
+                for enemy in standing:
+                    ui.print(health_bar(enemy.name, enemy.health, enemy.max_health))
+
+            action = policy(player, standing)
+            if action == ATTACK:
+                target = standing[0]
+                if ui is not None:
+                    ui.print(f"You strike {target.name}!")
+                target.take_damage(target.hit_damage)
+                if not target.is_alive():
+                    standing.pop(0)
+                    defeated.append(target)
+                    if ui is not None:
+                        ui.print(f"You defeated {target.name}!")
+                    if log is not None:
+                        log(f"Defeated {target.name} in combat.")
+                    if not standing:
+                        break
+            elif action == HEAL:
+                self.heal(player)
+            else:
+                if ui is not None:
+                    ui.print("Invalid action. You lose your turn!")
+                if log is not None:
+                    log(f"Invalid action '{action}' during fight.")
+
+            for enemy in standing:
+                health = player.health
+                player.take_damage(enemy.attack_damage(rng))
+                damage = health - player.health   #what got through the shield
+                if ui is not None:
+                    ui.print(enemy.describe_attack(damage))
+                if log is not None:
+                    log(f"{enemy.name} attacked! Player took {damage} damage. Current health: {player.health}.")
+                if player.health <= 0:
+                    if ui is not None:
+                        ui.print("You have been defeated!")
+                    if log is not None:
+                        log(f"Player was defeated by {enemy.name}.")
+                    break
+
+        return CombatResult(player.health > 0, defeated, turns)
+
+    def resolve_room(self, player, room, policy):
+        """
+        Fights every soldier in a room at once, removing the defeated ones.
+        :param player: The player
+        :param room: The room whose soldiers are fought
+        :param policy: A function (player, enemies) -> "attack" or "heal"
+        :return: A CombatResult
+        """
+        result = self.resolve(player, room.soldiers, policy)
+        for soldier in result.defeated:
+            room.remove_soldier(soldier)
+        return result
+
+    def heal(self, player):
+        """
+        Uses the first healing item the player carries.
+        :param player: The player
+        :return: True if the player healed
+        """
+        for item_id, amount in HEALING_ITEMS:
+            if player.backpack.discard_item_id(item_id):
+                player.heal(amount)
+                name = ITEMS.name(item_id)
+                if self.ui is not None:
+                    self.ui.print(f"You used a {name} and restored {amount} health.")
+                if self.log is not None:
+                    self.log(f"Player used a {name} and restored {amount} health.")
+                return True
+        if self.ui is not None:
+            self.ui.print("You have no healing items left!")
+        if self.log is not None:
+            self.log("Player attempted to heal but had no items.")
+        return False
+
+
+def health_bar(name, health, max_health):
+    """
+    Builds a visual health bar for a character.
+    :param name: Name of the character
+    :param health: Current health points
+    :param max_health: Maximum health points
+    """
+    bar_length = 20
+    filled_length = int(bar_length * health / max_health)
+    bar = "█" * filled_length + "-" * (bar_length - filled_length)
+    return f"{name} Health: [{bar}] {health}/{max_health}"
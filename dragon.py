@@ -0,0 +1,39 @@
+from history import Tracked
+
+
+class Dragon(Tracked):
+    """
+    This class represents the dragon guarding the Queen.
+    """
+    hit_damage = 40  # damage the knight's sword deals with each attack
+
+    def __init__(self, name="Dragon", health=200, min_damage=15, max_damage=30):
+        """
+        a dragon has a name, health, and a range of fire damage. """
+        self.name = name
+        self.health = health
+        self.max_health = health
+        self.min_damage = min_damage
+        self.max_damage = max_damage
+
+    def take_damage(self, damage):
+        """
+        This reduces the dragon's health when it takes damage.
+        """
+        self.health = max(self.health - damage, 0)
+
+    def is_alive(self):
+        return self.health > 0
+
+    def attack_damage(self, rng):
+        """
+        The dragon breathes fire for a random amount of damage.
+        :param rng: The random number generator to use
+        """
+        return rng.randint(self.min_damage, self.max_damage)
+
+    def describe_attack(self, damage):
+        return f"The dragon breathes fire and deals {damage} damage!"
+
+    def __str__(self):
+        return f"{self.name} (Health: {self.health})"
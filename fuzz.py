@@ -0,0 +1,231 @@
+"""
+Command fuzzer for the game.
+
+Plays random and grammar-built command streams through process_command
+with no console or log file, answering the attack / heal and backpack
+upgrade questions from the stream too. After every command it checks the
+game's invariants and notes which (room, capabilities, health bucket)
+states were reached. Any stream that raises an exception or breaks an
+invariant is cut down to a minimal stream that still does. Running this
+module fuzzes across all CPUs and prints a summary.
+"""
+import argparse
+import contextlib
+import os
+import random
+import time
+from multiprocessing import Pool
+
+from game import Game
+from registry import item_mask
+from text_ui import ScriptedUI
+from world_image import open_world_image
+
+VERBS = ["go", "pick", "drop", "use", "fight", "read", "solve", "look", "inventory", "help"]
+DIRECTIONS = ["north", "south", "east", "west", "upstairs", "downstairs", "secret", "out"]
+ITEM_NAMES = ["sword", "shield", "health drink", "health bag", "magic scroll", "key",
+              "ancient artifact", "enhanced sword"]
+ANSWERS = ["attack", "heal", "yes", "no"]
+JUNK = ["", "xyzzy", "NORTH", "Sword", "fight soldiers", "  ", "go", "42"]
+
+# Health is bucketed in steps of this many points for coverage
+HEALTH_BUCKET = 20
+
+
+def grammar_command(rng):
+    """
+    Builds a command that follows the game's grammar.
+    :param rng: The random number generator
+    :return: (command, answers) as run_stream takes them
+    """
+    verb = rng.choice(VERBS)
+    if verb == "go":
+        second = rng.choice(DIRECTIONS)
+    elif verb in ("pick", "drop", "use"):
+        second = rng.choice(ITEM_NAMES)
+    elif verb == "fight":
+        second = rng.choice(["soldiers", None])
+    else:
+        second = None
+    answers = tuple(rng.choice(ANSWERS) for _ in range(rng.randrange(4)))
+    return (verb, second), answers
+
+
+def random_command(rng):
+    """
+    Builds a command from any mix of words, valid or not.
+    :param rng: The random number generator
+    :return: (command, answers) as run_stream takes them
+    """
+    words = VERBS + DIRECTIONS + ITEM_NAMES + JUNK
+    first = rng.choice(words + [None])
+    second = rng.choice(words + [None, None])
+    answers = tuple(rng.choice(ANSWERS + JUNK) for _ in range(rng.randrange(4)))
+    return (first, second), answers
+
+
+def generate_stream(rng, length):
+    """
+    Builds a stream of commands, mostly from the grammar.
+    :param rng: The random number generator
+    :param length: The number of commands
+    :return: A list of (command, answers)
+    """
+    return [grammar_command(rng) if rng.random() < 0.8 else random_command(rng) for _ in range(length)]
+
+
+def check_invariants(game):
+    """
+    :param game: The game to check
+    :return: A description of the first broken invariant, or None
+    """
+    player = game.player
+    backpack = player.backpack
+    if player.health > player.max_health:
+        return f"health {player.health} is above max_health {player.max_health}"
+    if player.health < 0:
+        return f"health {player.health} is below zero"
+    if len(backpack.item_ids) > backpack.capacity:
+        return f"backpack holds {len(backpack.item_ids)} items but its capacity is {backpack.capacity}"
+    if backpack.capabilities != item_mask(backpack.item_ids):
+        return "backpack capabilities do not match its items"
+    if game.rooms.get(player.current_room.id) is not player.current_room:
+        return "player is in a room that is not part of the castle"
+    return None
+
+
+def run_stream(stream, seed, coverage=None):
+    """
+    Plays a command stream in a new game.
+    :param stream: A list of (command, answers)
+    :param seed: Seed for the game's random numbers, so the run can be repeated
+    :param coverage: A set to add the states reached to, or None
+    :return: (index of the failing command, description) or None if nothing failed
+    """
+    random.seed(seed)
+    ui = ScriptedUI()
+    game = Game(ui, log_file=None, cold_start=True)   #copies of rooms built once per worker from the image
+    for index, (command, answers) in enumerate(stream):
+        ui.answers.extend(answers)
+        try:
+            finished = game.process_command(command)
+        except Exception as error:
+            return index, f"{type(error).__name__}: {error}"
+        ui.answers.clear()
+        ui.lines.clear()
+        problem = check_invariants(game)
+        if problem is not None:
+            return index, problem
+        player = game.player
+        if coverage is not None:
+            coverage.add((player.current_room.id, player.capabilities, player.health // HEALTH_BUCKET))
+        if finished or player.health <= 0:
+            break
+    return None
+
+
+def minimize(stream, seed, failure):
+    """
+    Shrinks a failing stream by delta debugging: chunks of commands are
+    removed for as long as the same failure still happens.
+    :param stream: The failing stream
+    :param seed: The seed it fails with
+    :param failure: The description of the failure
+    :return: The smallest failing stream found
+    """
+    def fails(candidate):
+        result = run_stream(candidate, seed)
+        return result is not None and result[1] == failure
+
+    result = run_stream(stream, seed)
+    stream = stream[:result[0] + 1]
+    chunks = 2
+    while len(stream) >= 2:
+        size = -(-len(stream) // chunks)
+        for start in range(0, len(stream), size):
+            candidate = stream[:start] + stream[start + size:]
+            if candidate and fails(candidate):
+                stream = candidate
+                chunks = max(chunks - 1, 2)
+                break
+        else:
+            if chunks >= len(stream):
+                break
+            chunks = min(chunks * 2, len(stream))
+    return stream
+
+
+def fuzz_batch(seed, streams, length):
+    """
+    Fuzzes a batch of streams in one process.
+    :param seed: Seed for this batch
+    :param streams: How many streams to play
+    :param length: Commands per stream
+    :return: (coverage set, commands run, failures as (seed, description, minimal stream))
+    """
+    rng = random.Random(seed)
+    coverage = set()
+    commands = 0
+    failures = []
+    seen = set()
+    # The backpack prints straight to the console when an item is removed
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(streams):
+            stream_seed = rng.getrandbits(32)
+            stream = generate_stream(rng, length)
+            result = run_stream(stream, stream_seed, coverage)
+            commands += length if result is None else result[0] + 1
+            if result is not None and result[1] not in seen:
+                seen.add(result[1])
+                failures.append((stream_seed, result[1], minimize(stream, stream_seed, result[1])))
+    return coverage, commands, failures
+
+
+def fuzz(streams, length=40, workers=None, seed=0):
+    """
+    Fuzzes across worker processes.
+    :param streams: How many streams to play in total
+    :param length: Commands per stream
+    :param workers: The number of processes, or None for one per CPU
+    :param seed: The seed for the whole run
+    :return: (coverage set, commands run, failures)
+    """
+    batches = max(1, streams // 50)
+    jobs = [(seed * 1000003 + batch, streams // batches + (batch < streams % batches), length)
+            for batch in range(batches)]
+    coverage = set()
+    commands = 0
+    failures = {}
+    open_world_image()  #written once here, so the workers only map it
+    with Pool(workers) as pool:
+        for batch_coverage, batch_commands, batch_failures in pool.starmap(fuzz_batch, jobs):
+            coverage |= batch_coverage
+            commands += batch_commands
+            for stream_seed, description, stream in batch_failures:
+                if description not in failures or len(stream) < len(failures[description][1]):
+                    failures[description] = (stream_seed, stream)
+    return coverage, commands, failures
+
+
+def main():
+    """Fuzzes the game and prints coverage and minimal failing streams."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--streams", type=int, default=2000)
+    parser.add_argument("--length", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    coverage, commands, failures = fuzz(args.streams, args.length, args.workers, args.seed)
+    elapsed = time.perf_counter() - start
+    print(f"{commands} commands in {elapsed:.2f}s ({commands / elapsed:.0f} commands/s), "
+          f"{len(coverage)} states covered")
+    for description, (stream_seed, stream) in failures.items():
+        print(f"\n{description} (seed {stream_seed}, {len(stream)} commands):")
+        for command, answers in stream:
+            print(f"  {command} answers={list(answers)}")
+
+
+if __name__ == "__main__":
+    main()
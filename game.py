@@ -22,34 +22,107 @@ from backpack import Backpack
 import random
 from player import Player
 from soldier import Soldier
+from dragon import Dragon
+from combat import CombatEngine
+from scheduler import Scheduler, Roamer, Respawner
+from history import History
+from registry import item_bit
 import os
-
-
+import world_image
+
+
+#Capability bits checked by the commands
+SWORD = item_bit("sword")
+MAGIC_SCROLL = item_bit("magic scroll")
+HEALTH_DRINK = item_bit("health drink")
+HEALTH_BAG = item_bit("health bag")
+#What the player must carry to fight the dragon
+DRAGON_FIGHT_REQUIRES = SWORD
+#Damage of the sword's first strike at the dragon, ordinary and enchanted by the magic scroll
+SWORD_DAMAGE = 40
+MAGIC_SWORD_DAMAGE = 60
+#Rewards for defeating a soldier, one picked at random for each
+SOLDIER_REWARDS = ["bag_upgrade", "heal", "sword"]
+#Capacity a backpack upgrade adds
+BAG_UPGRADE = 5
+#Most turns that can be taken back
+HISTORY_LIMIT = 1000
+#Ticks between a soldier's moves, and between restocks of the tower's health drink
+PATROL_INTERVAL = 4
+RESTOCK_INTERVAL = 10
+
+
+def schedule_world_events(scheduler, world, owned=None):
+    """
+    Sets up the things that happen in the castle between commands.
+    :param scheduler: The Scheduler to run them on
+    :param world: The attributes create_rooms sets, as a dictionary
+    :param owned: IDs of the rooms to set them up in, all of them by default.
+        Soldiers only patrol these rooms.
+    :return: None
+    """
+    rooms = world["rooms"]
+    #Soldiers patrol the castle
+    for room_id in rooms if owned is None else owned:
+        room = rooms[room_id]
+        for soldier in room.get_soldiers():
+            scheduler.schedule(PATROL_INTERVAL, Roamer(soldier, room, PATROL_INTERVAL, within=owned))
+    #The tower's health drink is restocked
+    tower_room = world["tower_room"]
+    if owned is None or tower_room.id in owned:
+        scheduler.schedule(RESTOCK_INTERVAL, Respawner(tower_room, "health drink", RESTOCK_INTERVAL))
 
 
 class Game:
     """Main class for the game."""
 
-    def __init__(self):
+    def __init__(self, ui=None, log_file="game_log.txt", cold_start=False, world=None,
+                 history_limit=HISTORY_LIMIT):
         """
         Initialises the game.
-        """
-        self.create_rooms()
+        :param ui: The UI to play through, a TextUI by default
+        :param log_file: The file to log to, or None to turn logging off
+        :param cold_start: Build the rooms from the castle's world image instead of running create_rooms
+        :param world: Rooms built elsewhere to play in, as the dictionary world_image.load_world
+            returns. Their world events are left to whoever shares them out.
+        :param history_limit: The most turns that can be taken back, or 0 to turn undo off
+        """
+        shared = world is not None
+        if world is None and cold_start:
+            world = world_image.cold_world()
+        if world is None:
+            self.create_rooms()
+        else:
+            self.__dict__.update(world)
         self.player = Player(self.outside)
-        self.ui = TextUI()
+        self.ui = ui if ui is not None else TextUI()
         self.backpack = Backpack(5)
-        self.dragon_health = 200
-
-        #log file
-        self.log_file="game_log.txt"
-        if os.path.exists(self.log_file):
-            os.remove(self.log_file)
+        self.dragon = Dragon()
+        self.combat = CombatEngine(self.ui, self.log)
+        self.scheduler = Scheduler()
+        if not shared:
+            self.schedule_world_events()
+        self.room_router = None  #set when the rooms are split across shards
+        self.history = History(history_limit)
+
+        #log file, replaced by a new file when the first message is written
+        self.log_file = log_file
+        self.log_started = False
 
     def log(self, message):
         """
         This writes a log message to the log file.
         :param message: The message to log
         """
+        if self.log_file is None:
+            return
+        if not self.log_started:
+            # A new file rather than a truncated one, so anything following the log sees a new game
+            try:
+                os.remove(self.log_file)
+            except FileNotFoundError:
+                pass
+            self.log_started = True
         with open(self.log_file, "a") as log:
             log.write(f"{message}\n")
 
@@ -58,17 +131,17 @@ class Game:
             Sets up all room assets.
         :return: None
         """
-        self.garden = Room("you are in the castle's garden, enter the castle to save the queen")
-        self.outside = Room("You are outside the castle")
-        self.entrance_hall = Room("You are in the lobby of the castle, a hall with lights in the ceilings")
-        self.dining_room = Room("table room with dishes on it")
-        self.library = Room("An old room with book shelves",clue="The bookshelf might hide a secret passage, and the key is in the dungeon.")
-        self.armory = Room("A big room of weapons")
-        self.dungeon = Room("A dark, damp room with the faint sound of chains rattling")
-        self.tower_room = Room("A circular room with a window overlooking the castle grounds")
-        self.queens_quarters = Room("A luxurious room with elegant furnishings" , locked=True, key_item="key")
-        self.dragons_lair = Room("A fiery chamber where the dragon waits")
-        self.hidden_chamber = Room("A secret room concealed behind a bookshelf, full of mysterious artifacts")
+        self.garden = Room("you are in the castle's garden, enter the castle to save the queen", name="garden")
+        self.outside = Room("You are outside the castle", name="outside")
+        self.entrance_hall = Room("You are in the lobby of the castle, a hall with lights in the ceilings", name="entrance hall")
+        self.dining_room = Room("table room with dishes on it", name="dining room")
+        self.library = Room("An old room with book shelves",clue="The bookshelf might hide a secret passage, and the key is in the dungeon.", name="library")
+        self.armory = Room("A big room of weapons", name="armory")
+        self.dungeon = Room("A dark, damp room with the faint sound of chains rattling", name="dungeon")
+        self.tower_room = Room("A circular room with a window overlooking the castle grounds", name="tower room")
+        self.queens_quarters = Room("A luxurious room with elegant furnishings" , locked=True, key_item="key", name="queens quarters")
+        self.dragons_lair = Room("A fiery chamber where the dragon waits", name="dragons lair")
+        self.hidden_chamber = Room("A secret room concealed behind a bookshelf, full of mysterious artifacts", name="hidden chamber")
 
         self.dragons_lair.has_dragon = True
         self.queens_quarters.has_queen = True
@@ -123,6 +196,21 @@ class Game:
         self.garden.add_soldier(Soldier("Soldier in the Garden", health=50, damage=10))
         self.library.add_soldier(Soldier("Soldier in the Library", health=50, damage=10))
 
+        #Rooms by ID, numbered in this order so every process agrees on them
+        self.rooms = {}
+        for room_id, room in enumerate((
+                self.garden, self.outside, self.entrance_hall, self.dining_room, self.library, self.armory,
+                self.dungeon, self.tower_room, self.queens_quarters, self.dragons_lair, self.hidden_chamber)):
+            room.id = room_id
+            self.rooms[room_id] = room
+
+    def schedule_world_events(self):
+        """
+            Sets up the things that happen in the castle between commands.
+        :return: None
+        """
+        schedule_world_events(self.scheduler, vars(self))
+
     def play(self):
         """
             The main play loop.
@@ -150,7 +238,7 @@ class Game:
             Show a list of available commands.
         :return: None
         """
-        return ["help", "go", "quit", "pick" , "inventory","read", "solve", "fight", "use" , "fight soldiers", "look"]
+        return ["help", "go", "quit", "pick" , "inventory","read", "solve", "fight", "use" , "fight soldiers", "look", "undo", "redo", "rewind"]
 
     def do_look_command(self):
         """
@@ -181,7 +269,7 @@ class Game:
             self.ui.print("Pick up what?")
             return
 
-        if item in self.player.current_room.get_room_items():
+        if self.player.current_room.has_room_item(item):
             if item == "shield":
                 self.player.equip_shield()
                 self.player.current_room.remove_room_item(item)
@@ -212,7 +300,7 @@ class Game:
             self.player.backpack.remove_item(item)
             self.player.current_room.add_room_item(item)
             self.ui.print(f"You dropped the {item}.")
-            self.log(f"Player dropped {item} in {self.player.current_room.description}.")
+            self.log(f"Player dropped {item} in {Game.room_label(self.player.current_room)}.")
         else:
             self.ui.print(f"You are not carrying {item}.")
             self.log(f"Failed to drop {item}: not in inventory.")
@@ -238,67 +326,36 @@ class Game:
             self.log("Player attempted to solve a puzzle, but none was present.")
 
     def do_fight_command(self):
+        """
+        This method fights the dragon, if the player is in its lair and carries a sword.
+        :return: True if the fight took place
+        """
         if self.player.current_room != self.dragons_lair:
             self.ui.print("There is nothing to fight here.")
             self.log("Player attempted to fight, but no dragon was present.")
             return False
 
-        self.log("Player engaged the dragon in combat.")
-
-        if "sword" not in self.player.backpack.contents:
+        if self.player.capabilities & DRAGON_FIGHT_REQUIRES != DRAGON_FIGHT_REQUIRES:
             self.ui.print("You need a sword to fight the dragon!")
+            self.log("Player attempted to fight the dragon without a sword.")
             return False
 
-        sword_damage = 40
-        if "magic scroll" not in self.player.backpack.contents:
+        self.log("Player engaged the dragon in combat.")
+
+        sword_damage = SWORD_DAMAGE
+        if not self.player.capabilities & MAGIC_SCROLL:
             self.ui.print("Your sword is sharp but ordinary.")
         else:
             self.ui.print("Your sword glows with magical energy!")
-            sword_damage = 60
-        self.dragon_health -= sword_damage
+            sword_damage = MAGIC_SWORD_DAMAGE
+        self.dragon.take_damage(sword_damage)
 
         self.ui.print("The battle begins!")
-
-        while self.player.health > 0 and self.dragon_health > 0:
-            # Display health bars
-            self.ui.print(Game.health_bar("Knight", self.player.health, 100))
-            self.ui.print(Game.health_bar("Dragon", self.dragon_health, 200))
-            #Let the player decide what to do heal or attack
-            self.ui.print("What will you do? (attack / heal)")
-            action = input("> ").strip().lower()
-            if action == "attack":
-              # When the player attacks the dragon
-                self.ui.print("You strike the dragon!")
-                self.dragon_health -= 40
-                if self.dragon_health <= 0:
-                    self.ui.print("You have defeated the dragon!")
-                    self.ui.print("The Queen is safe! Congratulations, you win!")
-                    return True
-            elif action == "heal":
-                # When the player heals himself
-                if "health drink" in self.player.backpack.contents:
-                    self.player.backpack.remove_item("health drink")
-                    self.player.heal(30)
-                    self.ui.print("You used a health drink and restored 30 health.")
-                elif "health bag" in self.player.backpack.contents:
-                    self.player.backpack.remove_item("health bag")
-                    self.player.heal(50)
-                    self.ui.print("You used a health bag and restored 50 health.")
-                else:
-                    self.ui.print("You have no healing items left!")
-            else:
-                self.ui.print("Invalid action. You lose your turn!")
-
-            # when dragon does a counter-attack
-            damage = random.randint(15, 30)  # This random damages between 15 and 30 randomly
-            self.ui.print(f"The dragon breathes fire and deals {damage} damage!")
-            self.player.health -= damage
-            self.log(f"Dragon attacked! Player took {damage} damage. Current health: {self.player.health}.")
-            if self.player.health <= 0:
-                self.ui.print("Game Over !! You have been defeated by the dragon...")
-                self.log("Player was defeated by the dragon.")
-                return True
-
+        result = self.combat.resolve(self.player, [self.dragon], self.ask_combat_action)
+        if result.won:
+            self.ui.print("The Queen is safe! Congratulations, you win!")
+        else:
+            self.ui.print("Game Over !! You have been defeated by the dragon...")
         return True
 
     def do_use_command(self, item):
@@ -312,7 +369,7 @@ class Game:
             return
 
         if item == "health drink":
-            if "health drink" in self.player.backpack.contents:
+            if self.player.capabilities & HEALTH_DRINK:
                 self.player.backpack.remove_item("health drink")
                 self.player.heal(30)
                 self.ui.print("You used a health drink and restored 30 health.")
@@ -321,10 +378,11 @@ class Game:
                 self.ui.print("You don't have a health drink.")
                 self.log("Player tried to use health drink but none were available.")
         elif item == "health bag":
-            if "health bag" in self.player.backpack.contents:
+            if self.player.capabilities & HEALTH_BAG:
                 self.player.backpack.remove_item("health bag")
                 self.player.heal(50)
                 self.ui.print("You used a health bag. Restored 50 health.")
+                self.log("Player used a health bag and restored 50 health.")
             else:
                 self.ui.print("You don't have a health bag.")
         else:
@@ -334,17 +392,17 @@ class Game:
         """
         This Method offers the player a chance to upgrade their backpack capacity.
         """
-        new_capacity = self.player.backpack.capacity + 5
+        new_capacity = self.player.backpack.capacity + BAG_UPGRADE
         self.ui.print(f"A new backpack with capacity {new_capacity} is available!")
         self.ui.print("Do you want to upgrade? (yes/no)")
 
-        choice = input("> ").strip().lower()
+        choice = self.ui.get_input()
         if choice == "yes":
             # Upgrade the backpack
             new_backpack = Backpack(new_capacity)
             # This is to transfer items from the old backpack to the new one
-            for item in self.player.backpack.contents:
-                new_backpack.add_item(item)
+            for item_id in self.player.backpack.item_ids:
+                new_backpack.add_item_id(item_id)
             self.player.backpack = new_backpack
             self.ui.print(f"You upgraded your backpack to a capacity of {new_capacity}!")
         else:
@@ -352,7 +410,7 @@ class Game:
 
     def do_fight_soldier_command(self):
         """
-        This method allows the player to fight a soldier and earn a reward.
+        This method allows the player to fight the soldiers in the room and earn a reward for each.
         """
         soldiers = self.player.current_room.get_soldiers()
 
@@ -362,62 +420,34 @@ class Game:
             self.log("Attempted to fight, but no soldiers were present.")
             return
 
-        soldier = soldiers[0]
-        self.ui.print(f"You are fighting {soldier.name}!")
-        self.log(f"Engaged in a fight with {soldier.name}.")
-
-        while soldier.health > 0 and self.player.health > 0:
-            self.ui.print(self.health_bar("Knight", self.player.health, self.player.max_health))
-            self.ui.print(self.health_bar(soldier.name, soldier.health, 60))
-
-            #choice between to heal or to attack?
-            self.ui.print("What will you do? (attack / heal)")
-            action = input("> ").strip().lower()
-            if action == "attack":
-                # when the player attacks the soldier
-                self.ui.print("You attack the soldier!")
-                soldier.health -= 30
-                if soldier.health <= 0:
-                    self.ui.print(f"You defeated {soldier.name}!")
-                    self.player.current_room.remove_soldier(soldier)
-                    self.log(f"Defeated {soldier.name} in combat.")
-                    # This code is for the reward
-                    reward = random.choice(["bag_upgrade", "heal", "sword"])
-                    if reward == "bag_upgrade":
-                        self.ui.print("You are rewarded with a bag upgrade!")
-                        self.offer_bag_upgrade()
-                    elif reward == "heal":
-                        self.ui.print("You are rewarded with a full heal!")
-                        self.player.heal(self.player.max_health)
-                    elif reward == "sword":
-                        self.ui.print("You are rewarded with a stronger sword!")
-                        self.player.backpack.add_item("enhanced sword")
-                    return
-            elif action == "heal":
-                # when the player heals himself
-                if "health drink" in self.player.backpack.contents:
-                    self.player.backpack.remove_item("health drink")
-                    self.player.heal(30)
-                    self.ui.print("You used a health drink and restored 30 health.")
-                elif "health bag" in self.player.backpack.contents:
-                    self.player.backpack.remove_item("health bag")
-                    self.player.heal(50)
-                    self.ui.print("You used a health bag and restored 50 health.")
-                else:
-                    self.ui.print("You have no healing items left!")
-                    self.log("Player attempted to heal but had no items.")
-            else:
-                self.ui.print("Invalid action. You lose your turn!")
-                self.log(f"Invalid action '{action}' during fight.")
-
-            # when the soldier attacks the player
-            self.ui.print(f"{soldier.name} counter-attacks!")
-            damage = soldier.damage
-            self.player.take_damage(damage)
-            if self.player.health <= 0:
-                self.ui.print("You have been defeated!")
-                self.log(f"Player was defeated by {soldier.name}.")
-                return
+        names = ", ".join(soldier.name for soldier in soldiers)
+        self.ui.print(f"You are fighting {names}!")
+        self.log(f"Engaged in a fight with {names}.")
+
+        result = self.combat.resolve_room(self.player, self.player.current_room, self.ask_combat_action)
+        # This code is for the rewards, which only a player who won the fight gets
+        if not result.won:
+            return
+        for soldier in result.defeated:
+            reward = random.choice(SOLDIER_REWARDS)
+            if reward == "bag_upgrade":
+                self.ui.print("You are rewarded with a bag upgrade!")
+                self.offer_bag_upgrade()
+            elif reward == "heal":
+                self.ui.print("You are rewarded with a full heal!")
+                self.player.heal(self.player.max_health)
+            elif reward == "sword":
+                self.ui.print("You are rewarded with a stronger sword!")
+                self.player.backpack.add_item("enhanced sword")
+
+    def ask_combat_action(self, player, enemies):
+        """
+        This method asks the player what to do on their turn in a fight.
+        :return: The player's answer
+        """
+        #choice between to heal or to attack?
+        self.ui.print("What will you do? (attack / heal)")
+        return self.ui.get_input()
 
     def process_command(self, command):
         """
@@ -429,38 +459,79 @@ class Game:
         if command_word is not None:
             command_word = command_word.lower()
 
-        want_to_quit = False
-        if command_word == "help":
-            self.print_help()
-        elif command_word == "go":
-            self.do_go_command(second_word)
-        elif command_word == "quit":
-            want_to_quit = True
-            self.log("Player quit the game.")
-        elif command_word == "pick":
-            self.do_pick_up_command(second_word)
-        elif command_word == "inventory":
-            self.show_inventory()
-        elif command_word == "drop":
-            self.do_drop_command(second_word)
-        elif command_word == "read":
-            self.do_read_command()
-        elif command_word == "solve":
-            self.do_solve_command()
-        elif command_word =="fight" and second_word == "soldiers":
-            self.do_fight_soldier_command()
-        elif command_word == "fight":
-            self.do_fight_command()
-        elif command_word == "use":
-            self.do_use_command(second_word)
-        elif command_word == "look":
-            self.do_look_command()
-        else:
-            # Unknown command...
-            self.ui.print("Don't know what you mean.")
+        if command_word in ("undo", "redo", "rewind"):
+            self.do_rewind_command(command_word, second_word)
+            return False
+
+        self.history.begin_turn()
+        try:
+            want_to_quit = False
+            if command_word == "help":
+                self.print_help()
+            elif command_word == "go":
+                self.do_go_command(second_word)
+            elif command_word == "quit":
+                want_to_quit = True
+                self.log("Player quit the game.")
+            elif command_word == "pick":
+                self.do_pick_up_command(second_word)
+            elif command_word == "inventory":
+                self.show_inventory()
+            elif command_word == "drop":
+                self.do_drop_command(second_word)
+            elif command_word == "read":
+                self.do_read_command()
+            elif command_word == "solve":
+                self.do_solve_command()
+            elif command_word =="fight" and second_word == "soldiers":
+                self.do_fight_soldier_command()
+            elif command_word == "fight":
+                self.do_fight_command()
+            elif command_word == "use":
+                self.do_use_command(second_word)
+            elif command_word == "look":
+                self.do_look_command()
+            else:
+                # Unknown command...
+                self.ui.print("Don't know what you mean.")
 
+            if not want_to_quit:
+                self.scheduler.advance()
+        finally:
+            self.history.end_turn()
         return want_to_quit
 
+    def do_rewind_command(self, command_word, second_word):
+        """
+        This method takes back turns ('undo' or 'rewind <turns>') or plays an undone turn again ('redo').
+        :param command_word: undo, redo or rewind
+        :param second_word: for rewind, how many turns to take back
+        :return: None
+        """
+        if self.history.limit == 0:
+            self.ui.print("Time cannot be turned back here.")
+            return
+        if command_word == "redo":
+            if not self.history.redo():
+                self.ui.print("There is nothing to redo.")
+                return
+            self.ui.print("You replay your last undone turn.")
+            self.log("Player redid a turn.")
+        else:
+            turns = 1
+            if command_word == "rewind":
+                if second_word is None or not second_word.isdigit():
+                    self.ui.print("Rewind how many turns?")
+                    return
+                turns = int(second_word)
+            undone = self.history.rewind(turns)
+            if not undone:
+                self.ui.print("There is nothing to undo.")
+                return
+            self.ui.print(f"You turn back time by {undone} turn{'s' if undone > 1 else ''}.")
+            self.log(f"Player rewound {undone} turns.")
+        self.ui.print(self.player.current_room.get_long_description())
+
     def print_help(self):
         """
             Display some useful help text.
@@ -481,37 +552,64 @@ class Game:
             self.ui.print("Go where?")
             return
 
-        next_room = self.player.current_room.get_exit(second_word, self.player.backpack.contents)
+        next_room = self.player.current_room.get_exit(second_word, self.player.capabilities)
         if next_room == "locked":
             self.ui.print("The door is locked. You need a key to enter.")
             self.log(f"Attempted to go {second_word}, but the door is locked.")
         elif next_room is None:
             self.ui.print("There is no door!")
             self.log(f"Attempted to go {second_word}, but no door exists.")
+        elif self.room_router is not None and not self.room_router.owns(next_room):
+            # The room is hosted by another shard, which takes over from here
+            self.room_router.hand_off(self, next_room)
+            return
         else:
-            self.log(f"Player moved from {self.player.current_room.description} to {next_room.description}.")
-            self.player.current_room = next_room
-            self.ui.print(self.player.current_room.get_long_description())
+            self.enter_room(next_room)
+            return
+
+        if self.player.current_room == self.dragons_lair:
+            self.ui.print("You have entered the Dragon's Lair. The dragon roars fiercely!")
 
-            # Show the contents of the room
-            room_contents = self.player.current_room.describe_contents()
-            self.ui.print(f"Room contents: {room_contents}")
+    def enter_room(self, next_room):
+        """
+            Moves the player into a room and describes it.
+        :param next_room: the room the player walks into
+        :return: None
+        """
+        self.log(f"Player moved from {Game.room_label(self.player.current_room)} to {Game.room_label(next_room)}.")
+        self.player.current_room = next_room
+        self.ui.print(self.player.current_room.get_long_description())
+
+        # Show the contents of the room
+        room_contents = self.player.current_room.describe_contents()
+        self.ui.print(f"Room contents: {room_contents}")
 
         if self.player.current_room == self.dragons_lair:
             self.ui.print("You have entered the Dragon's Lair. The dragon roars fiercely!")
-            return
+
+    def get_state(self):
+        """
+            Captures the player's side of the game so it can be moved to another process.
+        :return: a tuple of plain values
+        """
+        return self.player.get_state(), self.dragon.health
+
+    def set_state(self, state):
+        """
+            Restores the player's side of the game from get_state().
+        :param state: the tuple returned by get_state()
+        :return: None
+        """
+        player_state, self.dragon.health = state
+        self.player.set_state(player_state, self.rooms)
+
     @staticmethod
-    def health_bar(name, health, max_health):
+    def room_label(room):
         """
-        This method displays a visual health bar for a character.
-        :param name: Name of the character
-        :param health: Current health points
-        :param max_health: Maximum health points
+        This method gives the name and ID a room is known by in the log.
+        :param room: The room to label
         """
-        bar_length = 20
-        filled_length = int(bar_length * health / max_health)
-        bar = "█" * filled_length + "-" * (bar_length - filled_length)
-        return f"{name} Health: [{bar}] {health}/{max_health}"
+        return f"{room.name} (#{room.id})"
 
 def main():
     """Main entry point for the game."""
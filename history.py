@@ -0,0 +1,177 @@
+"""
+Undo and redo for the game, kept as a log of inverse changes.
+
+Objects that make up the game state derive from Tracked. While a turn is
+being recorded, every attribute they assign is logged with its old value.
+Lists, arrays and dictionaries in the state are changed in place through
+insert(), delete() and store(), which log the one element that changed.
+Every logged change is (function, arguments): calling it undoes the change
+and returns the change that redoes it. Undoing a turn costs as much as the
+turn changed, not the size of the world, and since containers are undone
+element by element, rooms shared by several players keep the changes the
+other players made.
+"""
+from collections import deque
+
+# Stands in for an attribute that did not exist yet
+MISSING = object()
+
+# The changes of the turn being recorded, or None when nothing is recorded
+_journal = None
+
+
+class Tracked:
+    """A game object whose attribute changes can be undone."""
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        if _journal is not None:
+            _journal.append((_set, self, name, self.__dict__.get(name, MISSING)))
+        object.__setattr__(self, name, value)
+
+
+def _set(obj, name, value):
+    old = obj.__dict__.get(name, MISSING)
+    if value is MISSING:
+        delattr(obj, name)
+    else:
+        setattr(obj, name, value)
+    return _set, obj, name, old
+
+
+def _insert(container, index, value):
+    container.insert(index, value)
+    return _delete, container, index, value
+
+
+def _delete(container, index, value):
+    # Other players sharing the container may have moved the value, or taken it
+    if index >= len(container) or container[index] != value:
+        if value not in container:
+            return None
+        index = list(container).index(value)
+    del container[index]
+    return _insert, container, index, value
+
+
+def _store(mapping, key, value):
+    old = mapping.get(key, MISSING)
+    if value is MISSING:
+        del mapping[key]
+    else:
+        mapping[key] = value
+    return _store, mapping, key, old
+
+
+def insert(container, index, value):
+    """
+    Inserts a value into a list or array of the game state.
+    :param container: The list or array
+    :param index: Where to insert it
+    :param value: The value
+    """
+    container.insert(index, value)
+    if _journal is not None:
+        _journal.append((_delete, container, index, value))
+
+
+def delete(container, index):
+    """
+    Deletes a value from a list or array of the game state.
+    :param container: The list or array
+    :param index: Where the value is
+    :return: The value
+    """
+    value = container[index]
+    del container[index]
+    if _journal is not None:
+        _journal.append((_insert, container, index, value))
+    return value
+
+
+def store(mapping, key, value):
+    """
+    Sets a key of a dictionary of the game state.
+    :param mapping: The dictionary
+    :param key: The key
+    :param value: The value
+    """
+    if _journal is not None:
+        _journal.append((_store, mapping, key, mapping.get(key, MISSING)))
+    mapping[key] = value
+
+
+def _apply(changes):
+    """
+    Undoes a list of changes, last change first.
+    :param changes: (function, arguments...) tuples in the order they were logged
+    :return: The changes that reverse this, in the same form
+    """
+    reverse = []
+    for change in reversed(changes):
+        inverse = change[0](*change[1:])
+        if inverse is not None:
+            reverse.append(inverse)
+    return tuple(reverse)
+
+
+class History:
+    """
+    This class keeps the turns that can be undone and redone.
+    """
+
+    def __init__(self, limit=None):
+        """
+        :param limit: The most turns to keep, None to keep them all, or 0 to record nothing
+        """
+        self.limit = limit
+        self._undo = deque(maxlen=limit)
+        self._redo = []
+
+    def begin_turn(self):
+        """Starts recording the changes of a turn."""
+        global _journal
+        if self.limit != 0:
+            _journal = []
+
+    def end_turn(self):
+        """Stops recording and keeps the turn for undoing."""
+        global _journal
+        changes, _journal = _journal, None
+        if self.limit != 0:
+            self._undo.append(tuple(changes) if changes else ())
+            self._redo.clear()
+
+    def undo(self):
+        """
+        Takes back the last turn.
+        :return: True if there was a turn to undo
+        """
+        if not self._undo:
+            return False
+        self._redo.append(_apply(self._undo.pop()))
+        return True
+
+    def redo(self):
+        """
+        Plays again the last turn that was undone.
+        :return: True if there was a turn to redo
+        """
+        if not self._redo:
+            return False
+        self._undo.append(_apply(self._redo.pop()))
+        return True
+
+    def rewind(self, turns):
+        """
+        Takes back several turns.
+        :param turns: How many turns to undo
+        :return: How many turns were undone
+        """
+        undone = 0
+        while undone < turns and self.undo():
+            undone += 1
+        return undone
+
+    def __len__(self):
+        return len(self._undo)
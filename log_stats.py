@@ -0,0 +1,262 @@
+"""
+Streaming statistics over game log files.
+
+Log files are read line by line, so memory use does not grow with their
+size. Each file (and each "Game started." line inside one) counts as a run.
+Running this module prints a report for the files given on the command line.
+"""
+import argparse
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# Every game starts outside the castle
+START_ROOM = "outside"
+
+MOVED = re.compile(r"Player moved from (.+) \(#\d+\) to (.+) \(#\d+\)\.$")
+DRAGON_HIT = re.compile(r"Dragon attacked! Player took (\d+) damage\.")
+DEFEATED = re.compile(r"Player was defeated by (.+)\.$")
+HEALED = re.compile(r"Player used a (.+) and restored \d+ health\.$")
+BACKPACK_FULL = re.compile(r"Failed to pick up (.+) \(backpack full\)\.$")
+
+# Bytes kept from just before the read position, to tell a log that was rewritten from one that grew
+TAIL = 64
+
+
+class LogStats:
+    """
+    Totals gathered from game logs. Totals from different files can be
+    merged, so files can be read in parallel.
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.rooms_reached = Counter()   #room name to the number of runs that reached it
+        self.deaths = Counter()          #room name to the number of deaths there
+        self.killers = Counter()         #enemy name to the number of players it defeated
+        self.dragon_fights = 0
+        self.dragon_damage = 0
+        self.heals = Counter()           #healing item to the number of times it was used
+        self.backpack_full = Counter()   #item to the number of times it did not fit
+
+    def merge(self, other):
+        """
+        Adds another set of totals to these.
+        :param other: The LogStats to add
+        :return: self
+        """
+        self.runs += other.runs
+        self.rooms_reached.update(other.rooms_reached)
+        self.deaths.update(other.deaths)
+        self.killers.update(other.killers)
+        self.dragon_fights += other.dragon_fights
+        self.dragon_damage += other.dragon_damage
+        self.heals.update(other.heals)
+        self.backpack_full.update(other.backpack_full)
+        return self
+
+    def average_dragon_damage(self):
+        """
+        :return: The average damage taken from the dragon per run that fought it
+        """
+        return self.dragon_damage / self.dragon_fights if self.dragon_fights else 0.0
+
+    def report(self):
+        """
+        :return: The statistics as text
+        """
+        lines = [f"Runs: {self.runs}", "Rooms reached:"]
+        for room, count in self.rooms_reached.most_common():
+            lines.append(f"  {room}: {count} ({100 * count / self.runs:.0f}%)")
+        lines.append("Deaths by room:")
+        lines.extend(f"  {room}: {count}" for room, count in self.deaths.most_common())
+        lines.append("Deaths by enemy:")
+        lines.extend(f"  {enemy}: {count}" for enemy, count in self.killers.most_common())
+        lines.append(f"Dragon fights: {self.dragon_fights}, "
+                     f"average dragon damage taken: {self.average_dragon_damage():.1f}")
+        lines.append("Heals used:")
+        lines.extend(f"  {item}: {count}" for item, count in self.heals.most_common())
+        lines.append("Backpack full:")
+        lines.extend(f"  {item}: {count}" for item, count in self.backpack_full.most_common())
+        return "\n".join(lines)
+
+
+class LogParser:
+    """
+    Reads the lines of one log file into a LogStats, one line at a time.
+    Only the current run's room and the rooms it has reached are remembered.
+    """
+
+    def __init__(self, stats):
+        """
+        :param stats: The LogStats to add to
+        """
+        self.stats = stats
+        self.room = None
+        self.reached = set()
+        self.fought_dragon = False
+        self.events = 0   #lines read in the current run
+
+    def start_run(self):
+        """Starts counting a new run."""
+        self.stats.runs += 1
+        self.room = START_ROOM
+        self.reached = {START_ROOM}
+        self.fought_dragon = False
+        self.events = 0
+        self.stats.rooms_reached[START_ROOM] += 1
+
+    def feed(self, line):
+        """
+        Reads one log line.
+        :param line: The line, with or without its newline
+        """
+        line = line.rstrip("\n")
+        stats = self.stats
+        if line == "Game started.":
+            if self.room is None or self.events:
+                self.start_run()
+            return
+        if self.room is None:
+            self.start_run()
+        self.events += 1
+
+        if line.startswith("Player moved from "):
+            match = MOVED.match(line)
+            if match:
+                self.room = match.group(2)
+                if self.room not in self.reached:
+                    self.reached.add(self.room)
+                    stats.rooms_reached[self.room] += 1
+        elif line.startswith("Dragon attacked!"):
+            match = DRAGON_HIT.match(line)
+            if match:
+                stats.dragon_damage += int(match.group(1))
+        elif line == "Player engaged the dragon in combat.":
+            if not self.fought_dragon:
+                self.fought_dragon = True
+                stats.dragon_fights += 1
+        elif line.startswith("Player was defeated by "):
+            match = DEFEATED.match(line)
+            if match:
+                stats.deaths[self.room] += 1
+                stats.killers[match.group(1)] += 1
+        elif line.startswith("Player used a "):
+            match = HEALED.match(line)
+            if match:
+                stats.heals[match.group(1)] += 1
+        elif line.startswith("Failed to pick up "):
+            match = BACKPACK_FULL.match(line)
+            if match:
+                stats.backpack_full[match.group(1)] += 1
+
+
+def ingest_file(path):
+    """
+    Reads a whole log file.
+    :param path: The log file
+    :return: A LogStats for the file
+    """
+    stats = LogStats()
+    parser = LogParser(stats)
+    with open(path, encoding="utf-8", errors="replace") as log:
+        for line in log:
+            parser.feed(line)
+    return stats
+
+
+def ingest_files(paths, workers=None):
+    """
+    Reads many log files, spread across worker processes.
+    :param paths: The log files
+    :param workers: The number of processes, or None for one per CPU
+    :return: A LogStats for all the files together
+    """
+    stats = LogStats()
+    paths = list(paths)
+    if workers == 1 or len(paths) < 2:
+        for path in paths:
+            stats.merge(ingest_file(path))
+        return stats
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for file_stats in pool.map(ingest_file, paths, chunksize=max(1, len(paths) // 64)):
+            stats.merge(file_stats)
+    return stats
+
+
+class LogTailer:
+    """
+    Keeps statistics up to date as log files grow. Each poll reads only what
+    was written since the last one. A file is read again from the start when
+    it is replaced by a new file (as game_log.txt is when a game writes its
+    first line), shrinks, or no longer holds the bytes last read just before
+    the read position, which catches a file rewritten in place even when it
+    has already grown past that position. Only a new log that is the same,
+    byte for byte, as everything read from the old one goes unnoticed.
+    """
+
+    def __init__(self, stats=None):
+        """
+        :param stats: The LogStats to add to, or None for new totals
+        """
+        self.stats = stats if stats is not None else LogStats()
+        self._files = {}   #path to (file identity, offset, last bytes read, parser)
+
+    def poll(self, paths):
+        """
+        Reads whatever has been added to the files.
+        :param paths: The log files to follow
+        :return: The number of lines read
+        """
+        read = 0
+        for path in paths:
+            try:
+                status = os.stat(path)
+            except FileNotFoundError:
+                continue
+            identity = (status.st_dev, status.st_ino)
+            known, offset, tail, parser = self._files.get(path, (None, 0, b"", None))
+            with open(path, "rb") as log:
+                if offset:
+                    log.seek(offset - len(tail))
+                if known != identity or status.st_size < offset or log.read(len(tail)) != tail:
+                    offset, tail, parser = 0, b"", LogParser(self.stats)
+                    log.seek(0)
+                for raw in log:
+                    if not raw.endswith(b"\n"):
+                        break   #finish the line on a later poll
+                    offset += len(raw)
+                    tail = (tail + raw)[-TAIL:]
+                    parser.feed(raw.decode("utf-8", errors="replace"))
+                    read += 1
+            self._files[path] = (identity, offset, tail, parser)
+        return read
+
+
+def main():
+    """Prints statistics for game log files."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("paths", nargs="+", help="log files")
+    parser.add_argument("--workers", type=int, default=None, help="processes to read with")
+    parser.add_argument("--follow", type=float, default=None, metavar="SECONDS",
+                        help="keep reading the files as they grow, reporting every SECONDS")
+    args = parser.parse_args()
+
+    if args.follow is None:
+        print(ingest_files(args.paths, args.workers).report())
+        return
+    tailer = LogTailer()
+    try:
+        while True:
+            if tailer.poll(args.paths):
+                print(tailer.stats.report())
+                print()
+            time.sleep(args.follow)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
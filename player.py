@@ -1,6 +1,14 @@
+from array import array
+
 from backpack import Backpack
+from history import Tracked
+from registry import item_bit
+
+SHIELD = item_bit("shield")
+SHIELD_BLOCK = 10   #damage the shield takes off every hit
+SHIELD_HEALTH = 20  #maximum health the shield adds
 
-class Player:
+class Player(Tracked):
     """
     This Class represents the player, their inventory, and current location.
     """
@@ -15,12 +23,19 @@ class Player:
         self.max_health = 100
         self.has_shield = False
 
+    @property
+    def capabilities(self):
+        """
+        The capability mask of the player: the backpack's items plus an equipped shield.
+        """
+        return self.backpack.capabilities | (SHIELD if self.has_shield else 0)
+
     def take_damage(self, damage):
         """
         This Method reduces the player's health. If a shield is equipped, reduces damage taken.
         """
         if self.has_shield:
-            damage = max(damage - 10, 0)
+            damage = max(damage - SHIELD_BLOCK, 0)
         self.health -= damage
         self.health = max(self.health, 0)
 
@@ -45,5 +60,27 @@ class Player:
         """
         if not self.has_shield:
             self.has_shield = True
-            self.max_health += 20
-            self.health = self.max_health
\ No newline at end of file
+            self.max_health += SHIELD_HEALTH
+            self.health = self.max_health
+
+    def get_state(self):
+        """
+        This Method captures the player as plain values, with the room as its ID.
+        :return: a tuple that can be pickled or sent between processes
+        """
+        return (self.current_room.id, self.health, self.max_health, self.has_shield,
+                self.backpack.capacity, self.backpack.item_ids.tobytes())
+
+    def set_state(self, state, rooms):
+        """
+        This Method restores the player from get_state().
+        :param state: the tuple returned by get_state()
+        :param rooms: the rooms of the world, by ID
+        """
+        room_id, self.health, self.max_health, self.has_shield, capacity, items = state
+        self.current_room = rooms[room_id]
+        self.backpack = Backpack(capacity)
+        item_ids = array("H")
+        item_ids.frombytes(items)
+        for item_id in item_ids:
+            self.backpack.add_item_id(item_id)
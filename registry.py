@@ -0,0 +1,84 @@
+"""
+Registry module for giving item kinds compact integer IDs.
+"""
+import sys
+
+
+class Registry:
+    """
+    This class hands out dense integer IDs for names. Every name is interned,
+    so the same name always maps to the same ID and the same string object.
+    """
+
+    def __init__(self, names=()):
+        """
+        The constructor creates an empty registry.
+        :param names: Names to register up front, in ID order
+        """
+        self._ids = {}
+        self._names = []
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name):
+        """
+        Returns the ID for a name, registering the name if it is new.
+        :param name: The name to look up
+        :return: The integer ID of the name
+        """
+        ident = self._ids.get(name)
+        if ident is None:
+            ident = len(self._names)
+            name = sys.intern(name)
+            self._ids[name] = ident
+            self._names.append(name)
+        return ident
+
+    def lookup(self, name):
+        """
+        Returns the ID for a name without registering it.
+        :param name: The name to look up
+        :return: The integer ID, or None if the name is unknown
+        """
+        return self._ids.get(name)
+
+    def name(self, ident):
+        """
+        Returns the interned name for an ID.
+        :param ident: The integer ID
+        :return: The name registered under that ID
+        """
+        return self._names[ident]
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._ids
+
+
+# The item kinds the castle starts with are registered first so their IDs are
+# the same in every run.
+ITEMS = Registry(["sword", "shield", "health drink", "health bag", "magic scroll",
+                  "key", "ancient artifact", "enhanced sword"])
+
+
+def item_bit(item):
+    """
+    Returns the capability bit for an item kind.
+    :param item: The item name or ID
+    :return: An int with the item's bit set
+    """
+    return 1 << (item if isinstance(item, int) else ITEMS.intern(item))
+
+
+def item_mask(items):
+    """
+    Returns the capability mask covering several items.
+    :param items: Item names or IDs
+    :return: An int with the bit of every item set
+    """
+    mask = 0
+    for item in items:
+        mask |= item_bit(item)
+    return mask
@@ -2,23 +2,55 @@
 Create a room described "description". Initially, it has no exits. The
 'description' is something like 'kitchen' or 'an open court yard'.
 """
+import itertools
+import sys
+from array import array
 
+from history import Tracked, delete, insert, store
+from registry import ITEMS, item_mask
 
-class Room:
-    """A room in the game."""
+# IDs below this are left for worlds that number their own rooms, as create_rooms does
+RESERVED_ROOM_IDS = 1 << 16
+# IDs for rooms that are not given one by the world they belong to
+_room_ids = itertools.count(RESERVED_ROOM_IDS)
 
-    def __init__(self, description, locked=False, key_item=None, clue=None):
+
+def lock_mask(locked, key_items):
+    """
+    Returns the capability bits needed to enter a room.
+    :param locked: Whether the room is locked
+    :param key_items: The items needed to unlock it
+    :return: The mask; every bit, which no player has, for a locked room without keys
+    """
+    if locked and not key_items:
+        return -1
+    return item_mask(key_items)
+
+
+class Room(Tracked):
+    """
+    A room in the game. Its exits, items and soldiers are changed through
+    history's store, insert and delete, so each change can be undone alone.
+    """
+
+    def __init__(self, description, locked=False, key_item=None, clue=None, name=None, room_id=None):
         """
             Constructor method.
         :param description: Text description for this room
         :param locked: Boolean indicating if the room is locked
-        :param key_item: The item required to unlock the room
+        :param key_item: The item (or list of items) required to unlock the room
+        :param name: Short name used for the room in logs, defaults to the description
+        :param room_id: The room's ID in its world, below RESERVED_ROOM_IDS; a new unique ID above them by default
         """
         self.description = description
+        self.id = next(_room_ids) if room_id is None else room_id   #one per room, even if names repeat
+        self.name = sys.intern(name or description)
         self.exits = {}  # Dictionary
-        self.items = []    #list of items in the room
+        self.item_ids = array("H")    #IDs of the items in the room
         self.locked = locked
         self.key_item = key_item
+        self.key_items = [] if key_item is None else [key_item] if isinstance(key_item, str) else list(key_item)
+        self.lock_mask = lock_mask(locked, self.key_items)   #capability bits needed to enter
         self.clue = clue
         self.soldiers = []
         self.has_dragon = False
@@ -32,7 +64,7 @@ class Room:
         :param neighbour: The room that this direction takes you to
         :return: None
         """
-        self.exits[direction] = neighbour
+        store(self.exits, direction, neighbour)
 
     def get_short_description(self):
         """
@@ -79,27 +111,40 @@ class Room:
         all_exits = list(self.exits.keys())
         return all_exits
 
-    def get_exit(self, direction, player_inventory):
+    def get_exit(self, direction, capabilities):
         """
             Fetch an exit in a specified direction.
         :param direction: The direction that the player wishes to travel
-        :param player_inventory: List of items the player has
+        :param capabilities: Capability mask of the player (a list of items is also accepted)
         :return: Room object that this direction leads to, None if one does not exist
         """
         if direction in self.exits:
             next_room = self.exits[direction]
-            if next_room.locked and next_room.key_item not in player_inventory:
+            if not isinstance(capabilities, int):
+                # Names are only looked up, so unknown ones are not registered as items
+                item_ids = (ITEMS.lookup(item) for item in capabilities)
+                capabilities = item_mask(item_id for item_id in item_ids if item_id is not None)
+            if next_room.locked and next_room.lock_mask & ~capabilities:
                 return "locked"
             return next_room
         return None
 
+    @property
+    def items(self):
+        """
+        The names of the items in the room. This is a new list on every call,
+        so changing it does not change the room; use add_room_item and remove_room_item.
+        :return: List of item names
+        """
+        return [ITEMS.name(item_id) for item_id in self.item_ids]
+
     def add_room_item(self, item):
         """
         Adds an item to the room.
         :param item: The item to add
         :return: None
         """
-        self.items.append(item)
+        insert(self.item_ids, len(self.item_ids), ITEMS.intern(item))
 
     def remove_room_item(self, item):
         """
@@ -107,11 +152,21 @@ class Room:
         :param item: The item to remove
         :return: True if the item was removed, False if it wasn’t found
         """
-        if item in self.items:
-            self.items.remove(item)
+        item_id = ITEMS.lookup(item)
+        if item_id is not None and item_id in self.item_ids:
+            delete(self.item_ids, self.item_ids.index(item_id))
             return True
         return False
 
+    def has_room_item(self, item):
+        """
+        Checks whether an item is in the room.
+        :param item: The item to look for
+        :return: True if the item is in the room, False otherwise
+        """
+        item_id = ITEMS.lookup(item)
+        return item_id is not None and item_id in self.item_ids
+
     def get_room_items(self):
         """
         Returns a list of items in the room.
@@ -121,13 +176,34 @@ class Room:
 
     def add_soldier(self, soldier):
         """This method adds a soldier to the room."""
-        self.soldiers.append(soldier)
+        insert(self.soldiers, len(self.soldiers), soldier)
 
     def remove_soldier(self , soldier):
         """This method removes a soldier from the room."""
         if soldier in self.soldiers:
-            self.soldiers.remove(soldier)
+            delete(self.soldiers, self.soldiers.index(soldier))
 
     def get_soldiers(self):
         """This method gets the list of soldiers in the room."""
         return self.soldiers
+
+
+class RoomStub:
+    """
+    Stands in for a room that is built in another process, such as the far
+    side of an exit between shards. It only knows the room's ID, name and
+    lock, which is enough to check the door and hand the player over.
+    """
+    __slots__ = ("id", "name", "locked", "lock_mask")
+
+    def __init__(self, room_id, name, locked, key_items):
+        """
+        :param room_id: The room's ID
+        :param name: The room's short name
+        :param locked: Whether the room is locked
+        :param key_items: The items needed to unlock it
+        """
+        self.id = room_id
+        self.name = name
+        self.locked = locked
+        self.lock_mask = lock_mask(locked, key_items)
@@ -0,0 +1,148 @@
+"""
+World tick scheduler for things that happen between the player's commands.
+"""
+import heapq
+import itertools
+import random
+
+from history import Tracked
+
+
+class Event(Tracked):
+    """
+    A scheduled action. When it fires the action is called with its arguments;
+    if it returns a number of ticks the event is scheduled again that far ahead.
+    Setting due (None once the event is done) queues the event for that tick,
+    and any entry queued for it before is skipped. That lets undo put an
+    event back, or take it out, just by restoring its due tick.
+    """
+
+    def __init__(self, scheduler, due, action, args):
+        self.scheduler = scheduler
+        self.action = action
+        self.args = args
+        self.cancelled = False
+        self.due = due
+
+    def __setattr__(self, name, value):
+        Tracked.__setattr__(self, name, value)
+        if name == "due":
+            if value is None:
+                object.__setattr__(self, "queued", None)
+            else:
+                self.scheduler._push(self)
+
+    def __delattr__(self, name):
+        object.__delattr__(self, name)
+        if name == "due":
+            object.__setattr__(self, "queued", None)
+
+    def cancel(self):
+        """Stops the event from firing. It is dropped when it comes due."""
+        self.cancelled = True
+
+
+class Scheduler(Tracked):
+    """
+    This class keeps scheduled events in a heap ordered by the tick they are
+    due on, so advancing a tick only touches the events that are due, however
+    many are waiting.
+    """
+
+    def __init__(self):
+        self.tick = 0
+        self._queue = []    #heap of (due tick, sequence number, event)
+        self._sequence = itertools.count()  #keeps events due on the same tick in scheduling order
+
+    def schedule(self, delay, action, *args):
+        """
+        Schedules an action to run after a number of ticks.
+        :param delay: Ticks from now, at least 1
+        :param action: The function to call
+        :param args: Arguments for the function
+        :return: The Event, which can be cancelled
+        """
+        return Event(self, self.tick + max(delay, 1), action, args)
+
+    def _push(self, event):
+        sequence = next(self._sequence)
+        object.__setattr__(event, "queued", sequence)   #the event's live entry, not part of undo
+        heapq.heappush(self._queue, (event.due, sequence, event))
+
+    def advance(self, ticks=1):
+        """
+        Moves the world on and fires every event that has come due.
+        :param ticks: How many ticks to advance
+        :return: The number of events fired
+        """
+        fired = 0
+        queue = self._queue
+        for _ in range(ticks):
+            self.tick += 1
+            while queue and queue[0][0] <= self.tick:
+                _, sequence, event = heapq.heappop(queue)
+                if event.queued != sequence:
+                    continue    #rescheduled or undone since this entry was queued
+                if event.cancelled:
+                    event.due = None
+                    continue
+                fired += 1
+                delay = event.action(*event.args)
+                if delay is not None and not event.cancelled:
+                    event.due = self.tick + max(delay, 1)
+                else:
+                    event.due = None
+        return fired
+
+    def next_due(self):
+        """
+        :return: The tick the next event is due on, or None if nothing is scheduled
+        """
+        return self._queue[0][0] if self._queue else None
+
+    def __len__(self):
+        return len(self._queue)
+
+
+class Roamer(Tracked):
+    """
+    Moves a soldier to a random neighbouring room every few ticks. Soldiers
+    never walk through locked doors, into the dragon's lair or out of the
+    rooms they are kept within, and stop roaming once they are defeated or
+    taken out of their room.
+    """
+
+    def __init__(self, soldier, room, interval, rng=random, within=None):
+        self.soldier = soldier
+        self.room = room
+        self.interval = interval
+        self.rng = rng
+        self.within = within    #IDs of the rooms the soldier may walk into, or None for any
+
+    def __call__(self):
+        if not self.soldier.is_alive() or self.soldier not in self.room.soldiers:
+            return None
+        exits = [room for room in self.room.exits.values()
+                 if (self.within is None or room.id in self.within) and not room.locked and not room.has_dragon]
+        if exits:
+            next_room = exits[0] if len(exits) == 1 else self.rng.choice(exits)
+            self.room.remove_soldier(self.soldier)
+            next_room.add_soldier(self.soldier)
+            self.room = next_room
+        return self.interval
+
+
+class Respawner:
+    """
+    Puts an item back in a room every few ticks if it has been taken.
+    """
+
+    def __init__(self, room, item, interval):
+        self.room = room
+        self.item = item
+        self.interval = interval
+
+    def __call__(self):
+        if not self.room.has_room_item(self.item):
+            self.room.add_room_item(self.item)
+        return self.interval
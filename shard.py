@@ -0,0 +1,290 @@
+"""
+Runs the castle split into shards, each hosted by its own worker process.
+
+Every shard owns a group of rooms and plays the games of the players standing
+in them. A shard builds only the rooms it owns, from the castle's world image;
+exits into other shards lead to RoomStubs. When a player walks through such
+an exit, do_go_command hands the player's state to the coordinator, which
+passes it on to the owning shard. Shards talk to the coordinator over pipes
+(local sockets). Running this module starts a load test with simulated players.
+
+Each shard runs the world events of its own rooms on one scheduler, which
+moves on a tick with every command the shard handles, so a busy shard's
+world runs faster than a quiet one's. Soldiers patrol only the rooms of
+the shard they start in: they are not handed over at boundary exits.
+"""
+import argparse
+import multiprocessing
+import random
+import time
+from collections import deque
+
+from dragon import Dragon
+from game import Game, schedule_world_events
+from player import Player
+from scheduler import Scheduler
+from text_ui import ScriptedUI
+from world_image import IMAGE_PATH, WorldImage, WorldImageError, load_world, open_world_image
+
+# Messages sent to a shard before waiting for its replies, so neither side
+# fills its pipe while the other is still writing
+WINDOW = 64
+
+
+def partition_rooms(exits, start, shard_count):
+    """
+    Splits rooms into shards of neighbouring rooms, walking the exits
+    breadth first from the start so few exits cross between shards.
+    :param exits: A dictionary of room ID to the IDs of the rooms its exits lead to
+    :param start: The ID of the room the walk starts from
+    :param shard_count: How many shards to split into
+    :return: A dictionary of room ID to shard number
+    """
+    order = []
+    seen = {start}
+    queue = deque([start])
+    while queue:
+        room_id = queue.popleft()
+        order.append(room_id)
+        for neighbour in exits[room_id]:
+            if neighbour not in seen:
+                seen.add(neighbour)
+                queue.append(neighbour)
+    order.extend(room_id for room_id in exits if room_id not in seen)
+    size = -(-len(order) // shard_count)
+    return {room_id: index // size for index, room_id in enumerate(order)}
+
+
+class ShardRouter:
+    """Tells a game which rooms its shard owns and notes where a player leaves to."""
+
+    def __init__(self, owned):
+        self.owned = owned
+        self.destination = None
+
+    def owns(self, room):
+        return room.id in self.owned
+
+    def hand_off(self, game, room):
+        self.destination = room.id
+
+
+class ShardSession(Game):
+    """
+    A player's game on a shard. It plays in the shard's rooms instead of
+    building its own castle, talks through a ScriptedUI and keeps no log file.
+    Undo is off: the soldiers are shared with the other players on the shard,
+    and the player's turns do not follow them to another shard.
+    """
+
+    def __init__(self, shard, state):
+        """
+        :param shard: The shard hosting the game
+        :param state: The player's state, from Game.get_state()
+        """
+        super().__init__(ScriptedUI(), log_file=None, world=shard.world, history_limit=0)
+        self.scheduler = shard.scheduler    #every command moves the shard's world on
+        self.room_router = ShardRouter(shard.owned)
+        self.set_state(state)
+
+    def take_output(self):
+        """
+        :return: The lines printed since the last call
+        """
+        lines = self.ui.lines
+        self.ui.lines = []
+        return lines
+
+
+class Shard:
+    """The rooms and games hosted by one worker process."""
+
+    def __init__(self, owned, image_path=IMAGE_PATH):
+        """
+        :param owned: IDs of the rooms this shard owns
+        :param image_path: The world image to build them from
+        """
+        with WorldImage(image_path, verify=False) as image:   #the coordinator's open_world_image checked its stamp
+            self.world = load_world(image, owned)
+        self.rooms = self.world["rooms"]
+        self.owned = frozenset(owned)
+        self.scheduler = Scheduler()
+        schedule_world_events(self.scheduler, self.world, self.owned)
+        self.sessions = {}
+
+    def handle(self, message):
+        """
+        Handles one message from the coordinator.
+        :param message: ("join", player_id, state, room_id) or ("command", player_id, command, answers)
+        :return: (kind, player_id, lines, extra) where kind is "ok" or "handoff"
+        """
+        if message[0] == "join":
+            _, player_id, state, room_id = message
+            if room_id is not None:
+                # The player comes from a room this shard does not have, into room_id
+                player_state, dragon_health = state
+                state = ((room_id,) + player_state[1:], dragon_health)
+            session = ShardSession(self, state)
+            self.sessions[player_id] = session
+            if room_id is not None:
+                session.enter_room(session.player.current_room)
+            return "ok", player_id, session.take_output(), False
+
+        _, player_id, command, answers = message
+        session = self.sessions[player_id]
+        session.ui.answers.extend(answers)
+        finished = session.process_command(command)
+        lines = session.take_output()
+        destination = session.room_router.destination
+        if destination is not None:
+            del self.sessions[player_id]
+            return "handoff", player_id, lines, (session.get_state(), destination)
+        if finished:
+            del self.sessions[player_id]
+        return "ok", player_id, lines, finished
+
+
+def serve_shard(owned, connection, image_path):
+    """
+    The main loop of a shard worker process.
+    :param owned: IDs of the rooms the shard owns
+    :param connection: The pipe to the coordinator
+    :param image_path: The world image to build the rooms from
+    """
+    shard = Shard(owned, image_path)
+    while True:
+        message = connection.recv()
+        if message[0] == "stop":
+            break
+        connection.send(shard.handle(message))
+    connection.close()
+
+
+class ShardedWorld:
+    """
+    The coordinator: starts the shard processes and routes each player's
+    commands to the shard that owns the room they are in.
+    """
+
+    def __init__(self, shard_count, image_path=IMAGE_PATH):
+        """
+        :param shard_count: How many worker processes to split the castle across
+        :param image_path: The castle's world image, written first if it is missing or stale
+        """
+        image = open_world_image(image_path)
+        if image is None:
+            raise WorldImageError(f"No world image could be written to {image_path}.")
+        # The coordinator only reads the exits; every room is a stub here
+        layout = load_world(image, ())
+        exits = {view.number: view.exits.values() for view in image.rooms()}
+        self.owner = partition_rooms(exits, layout["outside"].id, shard_count)
+        self.start_state = (Player(layout["outside"]).get_state(), Dragon().health)
+        self.locations = {}  #player ID to the shard hosting them
+        self.handoffs = 0
+        self.connections = []
+        self.processes = []
+        for index in range(shard_count):
+            owned = [room_id for room_id, shard in self.owner.items() if shard == index]
+            connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=serve_shard, args=(owned, child_connection, image_path),
+                                              daemon=True)
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def join(self, player_ids):
+        """
+        Starts new players outside the castle.
+        :param player_ids: IDs for the new players
+        :return: A dictionary of player ID to the lines printed for them
+        """
+        shard = self.owner[self.start_state[0][0]]
+        return self._exchange([(shard, ("join", player_id, self.start_state, None)) for player_id in player_ids])
+
+    def play(self, commands):
+        """
+        Runs one command for each of several players.
+        :param commands: A dictionary of player ID to (command, answers), where
+            command is the (command_word, second_word) tuple process_command takes
+            and answers are the replies to any questions it asks
+        :return: A dictionary of player ID to the lines printed for them
+        """
+        return self._exchange([(self.locations[player_id], ("command", player_id, command, answers))
+                               for player_id, (command, answers) in commands.items()])
+
+    def _exchange(self, messages):
+        """
+        Sends messages to the shards and collects the replies, passing players
+        on to the next shard when they cross a boundary.
+        :param messages: A list of (shard number, message)
+        :return: A dictionary of player ID to the lines printed for them
+        """
+        output = {}
+        while messages:
+            outbox = [[] for _ in self.connections]
+            for shard, message in messages:
+                outbox[shard].append(message)
+            messages = []
+            for shard, queued in enumerate(outbox):
+                connection = self.connections[shard]
+                for start in range(0, len(queued), WINDOW):
+                    window = queued[start:start + WINDOW]
+                    for message in window:
+                        connection.send(message)
+                    for _ in window:
+                        kind, player_id, lines, extra = connection.recv()
+                        output.setdefault(player_id, []).extend(lines)
+                        if kind == "handoff":
+                            state, room_id = extra
+                            destination = self.owner[room_id]
+                            self.locations[player_id] = destination
+                            self.handoffs += 1
+                            messages.append((destination, ("join", player_id, state, room_id)))
+                        elif extra:
+                            del self.locations[player_id]
+                        else:
+                            self.locations[player_id] = shard
+        return output
+
+    def close(self):
+        """Stops the shard processes."""
+        for connection in self.connections:
+            connection.send(("stop",))
+        for process in self.processes:
+            process.join()
+
+
+def main():
+    """Load test: simulated players wander a sharded castle."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    directions = ["north", "south", "east", "west", "upstairs", "downstairs", "secret", "out"]
+    world = ShardedWorld(args.shards)
+    try:
+        players = range(args.players)
+        start = time.perf_counter()
+        world.join(players)
+        for _ in range(args.turns):
+            commands = {}
+            for player_id in players:
+                if rng.random() < 0.8:
+                    commands[player_id] = (("go", rng.choice(directions)), ())
+                else:
+                    commands[player_id] = (("look", None), ())
+            world.play(commands)
+        elapsed = time.perf_counter() - start
+    finally:
+        world.close()
+    total = args.players * args.turns
+    print(f"{args.players} players, {args.shards} shards: {total} commands in {elapsed:.2f}s "
+          f"({total / elapsed:.0f} commands/s), {world.handoffs} handoffs")
+
+
+if __name__ == "__main__":
+    main()
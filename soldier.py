@@ -1,12 +1,18 @@
-class Soldier:
+from history import Tracked
+
+
+class Soldier(Tracked):
     """
     This class represents the soldiers the player can fight.
     """
+    hit_damage = 30  # damage the knight deals with each attack
+
     def __init__(self, name, health , damage ):
         """
          a soldier has a name, health, and damage value. """
         self.name = name
         self.health = health
+        self.max_health = health
         self.damage = damage
 
     def take_damage(self, damage):
@@ -20,5 +26,15 @@ class Soldier:
     def is_alive(self):
         return self.health > 0
 
+    def attack_damage(self, rng):
+        """
+        A soldier always hits for the same damage.
+        :param rng: The random number generator (unused)
+        """
+        return self.damage
+
+    def describe_attack(self, damage):
+        return f"{self.name} counter-attacks!"
+
     def __str__(self):
         return f"{self.name} (Health: {self.health}, Damage: {self.damage})"
\ No newline at end of file
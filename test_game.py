@@ -1,8 +1,30 @@
+import random
 import unittest
-from room import Room
+from unittest import mock
+from room import Room, RoomStub
 from player import Player
 from soldier import Soldier
-from game import Game
+from game import Game, SOLDIER_REWARDS
+from text_ui import ScriptedUI
+from backpack import Backpack
+from registry import Registry, ITEMS, item_mask
+from dragon import Dragon
+from combat import CombatEngine, attack_policy, cautious_policy
+from scheduler import Scheduler, Roamer, Respawner
+from shard import Shard, ShardedWorld, partition_rooms
+from world_image import RoomView, WorldImage, WorldImageError, load_world, room_attributes, write_world_image
+from log_stats import LogTailer, ingest_files
+import fuzz
+import world_image
+import mmap
+import os
+import tempfile
+
+try:
+    import numpy
+    from vector_game import VectorGame
+except ImportError:    #numpy is only needed for the vectorized games
+    numpy = None
 
 
 class TestRoom(unittest.TestCase):
@@ -22,6 +44,12 @@ class TestRoom(unittest.TestCase):
         self.room.clue = "This is a clue."
         self.assertEqual(self.room.clue, "This is a clue.")
 
+    def test_door_needing_two_keys(self):
+        vault = Room("A vault", locked=True, key_item=["key", "ancient artifact"])
+        self.room.set_exit("down", vault)
+        self.assertEqual(self.room.get_exit("down", item_mask(["key"])), "locked")
+        self.assertIs(self.room.get_exit("down", item_mask(["key", "ancient artifact", "sword"])), vault)
+
     def test_room_soldiers(self):
         soldier = Soldier("Guard", 50, 10)
         self.room.add_soldier(soldier)
@@ -30,6 +58,21 @@ class TestRoom(unittest.TestCase):
         self.assertNotIn(soldier, self.room.get_soldiers())
 
 
+    def test_exit_with_item_names(self):
+        door = Room("Vault", locked=True, key_item="key")
+        self.room.set_exit("north", door)
+        items = len(ITEMS)
+        self.assertEqual(self.room.get_exit("north", ["pebble nobody registered"]), "locked")
+        self.assertIs(self.room.get_exit("north", ["key"]), door)
+        self.assertEqual(len(ITEMS), items)
+
+    def test_locked_door_without_a_key(self):
+        door = Room("Sealed", locked=True)
+        self.room.set_exit("north", door)
+        self.assertEqual(self.room.get_exit("north", item_mask(["key", "sword"])), "locked")
+        self.assertEqual(self.room.get_exit("north", ["key"]), "locked")
+
+
 class TestPlayer(unittest.TestCase):
     def setUp(self):
         self.room = Room("Starting Room")
@@ -67,6 +110,593 @@ class TestSoldier(unittest.TestCase):
         self.assertFalse(self.soldier.is_alive())
 
 
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry(["sword"])
+
+    def test_ids_are_dense_and_stable(self):
+        self.assertEqual(self.registry.intern("sword"), 0)
+        self.assertEqual(self.registry.intern("key"), 1)
+        self.assertEqual(self.registry.intern("key"), 1)
+        self.assertEqual(self.registry.name(1), "key")
+        self.assertIsNone(self.registry.lookup("shield"))
+
+    def test_backpack_stores_ids(self):
+        backpack = Backpack(2)
+        backpack.add_item("key")
+        self.assertEqual(list(backpack.item_ids), [ITEMS.lookup("key")])
+        self.assertEqual(backpack.contents, ["key"])
+        self.assertTrue(backpack.check_item("key"))
+        self.assertFalse(backpack.check_item("unknown thing"))
+
+    def test_backpack_capabilities(self):
+        backpack = Backpack(3)
+        backpack.add_item("health drink")
+        backpack.add_item("health drink")
+        backpack.remove_item("health drink")
+        self.assertEqual(backpack.capabilities, item_mask(["health drink"]))
+        backpack.remove_item("health drink")
+        self.assertEqual(backpack.capabilities, 0)
+
+
+class TestCombat(unittest.TestCase):
+    def setUp(self):
+        self.engine = CombatEngine(rng=random.Random(1))
+        self.room = Room("Barracks")
+        self.player = Player(self.room)
+
+    def test_whole_room_is_resolved(self):
+        for number in range(3):
+            self.room.add_soldier(Soldier(f"Guard {number}", health=30, damage=5))
+        result = self.engine.resolve_room(self.player, self.room, attack_policy)
+        self.assertTrue(result.won)
+        self.assertEqual(len(result.defeated), 3)
+        self.assertEqual(self.room.get_soldiers(), [])
+        # Two guards strike after the first falls, then one after the second
+        self.assertEqual(self.player.health, 100 - 2 * 5 - 5)
+
+    def test_player_can_lose(self):
+        self.room.add_soldier(Soldier("Champion", health=500, damage=40))
+        result = self.engine.resolve_room(self.player, self.room, attack_policy)
+        self.assertFalse(result.won)
+        self.assertEqual(self.player.health, 0)
+        self.assertEqual(len(self.room.get_soldiers()), 1)
+
+    def test_heal_uses_backpack(self):
+        self.player.health = 20
+        self.player.backpack.add_item("health drink")
+        dragon = Dragon(health=80)
+        result = self.engine.resolve(self.player, [dragon], cautious_policy)
+        self.assertFalse(self.player.backpack.check_item("health drink"))
+        self.assertEqual(result.turns, 3)
+
+    def test_shielded_damage_is_logged_as_taken(self):
+        lines = []
+        engine = CombatEngine(log=lines.append, rng=random.Random(1))
+        self.player.equip_shield()
+        self.room.add_soldier(Soldier("Guard", health=100, damage=15))
+        engine.resolve_room(self.player, self.room, attack_policy)
+        self.assertIn("Guard attacked! Player took 5 damage. Current health: 115.", lines)
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+
+    def test_only_due_events_fire(self):
+        fired = []
+        self.scheduler.schedule(2, fired.append, "late")
+        self.scheduler.schedule(1, fired.append, "early")
+        cancelled = self.scheduler.schedule(1, fired.append, "cancelled")
+        cancelled.cancel()
+        self.assertEqual(self.scheduler.advance(), 1)
+        self.assertEqual(fired, ["early"])
+        self.scheduler.advance()
+        self.assertEqual(fired, ["early", "late"])
+        self.assertIsNone(self.scheduler.next_due())
+
+    def test_soldier_roams(self):
+        hall = Room("Hall")
+        yard = Room("Yard")
+        hall.set_exit("out", yard)
+        yard.set_exit("in", hall)
+        soldier = Soldier("Guard", 50, 10)
+        hall.add_soldier(soldier)
+        self.scheduler.schedule(1, Roamer(soldier, hall, 1))
+        self.scheduler.advance()
+        self.assertEqual(yard.get_soldiers(), [soldier])
+        self.scheduler.advance()
+        self.assertEqual(hall.get_soldiers(), [soldier])
+        hall.remove_soldier(soldier)
+        self.scheduler.advance()
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_item_respawns(self):
+        room = Room("Pantry")
+        self.scheduler.schedule(3, Respawner(room, "health drink", 3))
+        self.scheduler.advance(3)
+        self.assertEqual(room.get_room_items(), ["health drink"])
+        self.scheduler.advance(3)
+        self.assertEqual(room.get_room_items(), ["health drink"])
+
+
+class TestShards(unittest.TestCase):
+    def test_partition_covers_every_room(self):
+        game = Game()
+        exits = {room_id: [neighbour.id for neighbour in room.exits.values()] for room_id, room in game.rooms.items()}
+        owner = partition_rooms(exits, game.outside.id, 3)
+        self.assertEqual(set(owner), set(game.rooms))
+        self.assertEqual(set(owner.values()), {0, 1, 2})
+
+    def test_shard_builds_only_its_rooms(self):
+        game = Game()
+        world_image.open_world_image()
+        decoded = []
+        description = RoomView.description.fget
+        with mock.patch.object(RoomView, "description",
+                               property(lambda view: decoded.append(view.number) or description(view))):
+            shard = Shard([game.armory.id, game.dungeon.id])
+        self.assertEqual(set(shard.rooms), {game.armory.id, game.dungeon.id})
+        self.assertEqual(sorted(decoded), sorted([game.armory.id, game.dungeon.id]))
+        stub = shard.rooms[game.armory.id].exits["west"]
+        self.assertIsInstance(stub, RoomStub)
+        self.assertEqual(stub.id, game.dining_room.id)
+        shard.handle(("join", 1, game.get_state(), game.armory.id))
+        kind, _, _, (state, room_id) = shard.handle(("command", 1, ("go", "west"), ()))
+        self.assertEqual((kind, room_id), ("handoff", game.dining_room.id))
+
+    def test_shard_runs_the_events_of_its_rooms(self):
+        game = Game()
+        world_image.open_world_image()
+        shard = Shard([game.garden.id, game.outside.id])
+        garden, outside = shard.rooms[game.garden.id], shard.rooms[game.outside.id]
+        shard.handle(("join", 1, game.get_state(), game.outside.id))
+        for _ in range(4):
+            shard.handle(("command", 1, ("look", None), ()))
+        self.assertEqual([soldier.name for soldier in outside.get_soldiers()], ["Soldier in the Garden"])
+        for _ in range(40):
+            shard.handle(("command", 1, ("look", None), ()))
+        self.assertEqual(len(garden.get_soldiers()) + len(outside.get_soldiers()), 1)
+        tower = Shard([game.tower_room.id])
+        tower.rooms[game.tower_room.id].remove_room_item("health drink")
+        tower.scheduler.advance(10)
+        self.assertTrue(tower.rooms[game.tower_room.id].has_room_item("health drink"))
+
+    def test_player_is_handed_between_shards(self):
+        world = ShardedWorld(len(Game().rooms))
+        try:
+            world.join([7])
+            output = world.play({7: (("go", "north"), ())})
+            output = world.play({7: (("go", "north"), ())})
+        finally:
+            world.close()
+        self.assertEqual(world.handoffs, 2)
+        self.assertIn("Location: table room with dishes on it, Exits: ['south', 'east'].", output[7])
+
+
+class TestWorldImage(unittest.TestCase):
+    def setUp(self):
+        self.game = Game()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "castle.world")
+        write_world_image(self.path, self.game.rooms.values(), room_attributes(self.game))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_rooms_read_back(self):
+        with WorldImage(self.path) as image:
+            self.assertEqual(image.room_count, len(self.game.rooms))
+            for view, room in zip(image.rooms(), self.game.rooms.values()):
+                self.assertEqual(view.name, room.name)
+                self.assertEqual(view.description, room.description)
+                self.assertEqual(view.clue, room.clue)
+                self.assertEqual(view.items, room.items)
+                self.assertEqual(view.key_items, room.key_items)
+                self.assertEqual(view.locked, room.locked)
+                self.assertEqual(list(view.exits), room.get_exits())
+                self.assertEqual(view.soldiers, [(soldier.name, soldier.health, soldier.damage)
+                                                 for soldier in room.soldiers])
+                self.assertIs(getattr(self.game, view.attribute), room)
+            library = image.find_room("library")
+            self.assertEqual(library.get_exit("secret").name, "hidden chamber")
+            self.assertTrue(image.find_room("dragons lair").has_dragon)
+
+    def test_bad_file_is_rejected(self):
+        maps = []
+        real_mmap = mmap.mmap
+
+        def mapped(*args, **kwargs):
+            maps.append(real_mmap(*args, **kwargs))
+            return maps[-1]
+
+        with open(self.path, "r+b") as image:
+            image.seek(-1, os.SEEK_END)
+            image.write(b"!")
+        with mock.patch("mmap.mmap", mapped), self.assertRaises(WorldImageError):
+            WorldImage(self.path)
+        self.assertTrue(maps[0].closed)
+        with open(self.path, "r+b") as image:
+            image.write(b"JUNK")
+        with self.assertRaises(WorldImageError):
+            WorldImage(self.path)
+
+    def test_world_built_from_image(self):
+        game = Game(ScriptedUI(), log_file=None)
+        with WorldImage(self.path) as image:
+            game.__dict__.update(load_world(image))
+        self.assertEqual(snapshot(game), snapshot(self.game))
+        self.assertIs(game.library.exits["secret"], game.hidden_chamber)
+        self.assertEqual(game.garden.soldiers[0].name, "Soldier in the Garden")
+
+    def test_part_of_the_world_built_from_image(self):
+        with WorldImage(self.path) as image:
+            world = load_world(image, [self.game.armory.id, self.game.dungeon.id])
+        self.assertEqual(set(world["rooms"]), {self.game.armory.id, self.game.dungeon.id})
+        self.assertIs(world["armory"].exits["downstairs"], world["dungeon"])
+        stub = world["dungeon"].exits["west"]
+        self.assertIsInstance(stub, RoomStub)
+        self.assertIs(stub, world["hidden_chamber"])
+        self.assertEqual((stub.id, stub.name), (self.game.hidden_chamber.id, "hidden chamber"))
+        self.assertEqual(world["queens_quarters"].lock_mask, self.game.queens_quarters.lock_mask)
+
+
+class TestLogStats(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.game = Game(ScriptedUI(), os.path.join(self.directory.name, "run1.txt"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_funnel_from_a_played_game(self):
+        self.game.print_welcome()
+        for direction in ["north", "north", "east"]:
+            self.game.do_go_command(direction)
+        for item in ["sword", "shield", "sword"]:
+            self.game.do_pick_up_command(item)
+        second = os.path.join(self.directory.name, "run2.txt")
+        with open(second, "w") as log:
+            log.write("Game started.\n"
+                      "Player engaged the dragon in combat.\n"
+                      "Player used a health bag and restored 50 health.\n"
+                      "Dragon attacked! Player took 20 damage. Current health: 80.\n"
+                      "Dragon attacked! Player took 30 damage. Current health: 50.\n"
+                      "Failed to pick up key (backpack full).\n"
+                      "Player was defeated by Dragon.\n")
+        stats = ingest_files([self.game.log_file, second], workers=2)
+        self.assertEqual(stats.runs, 2)
+        self.assertEqual(stats.rooms_reached["outside"], 2)
+        self.assertEqual(stats.rooms_reached["armory"], 1)
+        self.assertEqual(stats.deaths, {"outside": 1})
+        self.assertEqual(stats.average_dragon_damage(), 50)
+        self.assertEqual(stats.heals["health bag"], 1)
+        self.assertEqual(stats.backpack_full["key"], 1)
+
+    def test_fight_without_a_sword_is_not_counted(self):
+        self.game.log("Game started.")
+        self.game.player.current_room = self.game.dragons_lair
+        self.game.do_fight_command()
+        stats = ingest_files([self.game.log_file], workers=1)
+        self.assertEqual(stats.dragon_fights, 0)
+
+    def test_tailer_reads_only_new_lines(self):
+        tailer = LogTailer()
+        self.game.log("Game started.")
+        self.game.do_go_command("north")
+        self.assertEqual(tailer.poll([self.game.log_file]), 2)
+        self.assertEqual(tailer.poll([self.game.log_file]), 0)
+        self.game.do_go_command("north")
+        self.assertEqual(tailer.poll([self.game.log_file]), 1)
+        self.assertEqual(tailer.stats.runs, 1)
+        self.assertEqual(tailer.stats.rooms_reached["dining room"], 1)
+
+    def test_tailer_notices_a_new_game(self):
+        tailer = LogTailer()
+        self.game.log("Game started.")
+        for direction in ["north", "north", "east"]:
+            self.game.do_go_command(direction)
+        self.assertEqual(tailer.poll([self.game.log_file]), 4)
+        second = Game(ScriptedUI(), self.game.log_file)
+        second.log("Game started.")
+        for direction in ["south", "north", "north", "east", "west", "south", "south"]:
+            second.do_go_command(direction)
+        self.assertEqual(tailer.poll([self.game.log_file]), 8)
+        self.assertEqual(tailer.stats.runs, 2)
+        self.assertEqual(tailer.stats.rooms_reached["garden"], 1)
+
+    def test_tailer_notices_a_log_rewritten_in_place(self):
+        tailer = LogTailer()
+        with open(self.game.log_file, "w") as log:
+            log.write("Game started.\nPlayer moved from outside (#1) to entrance hall (#2).\n")
+        tailer.poll([self.game.log_file])
+        with open(self.game.log_file, "r+") as log:
+            log.write("Game started.\nPlayer moved from outside (#1) to garden (#0).\n"
+                      "Player moved from garden (#0) to outside (#1).\n")
+        self.assertEqual(tailer.poll([self.game.log_file]), 3)
+        self.assertEqual(tailer.stats.runs, 2)
+        self.assertEqual(tailer.stats.rooms_reached["garden"], 1)
+
+
+class TestFuzz(unittest.TestCase):
+    def test_generated_streams_keep_invariants(self):
+        coverage, commands, failures = fuzz.fuzz_batch(seed=3, streams=20, length=30)
+        self.assertEqual(failures, [])
+        self.assertGreater(len(coverage), 1)
+
+    def test_failing_stream_is_minimized(self):
+        def armory_is_forbidden(game):
+            return "reached the armory" if game.player.current_room is game.armory else None
+
+        stream = [(("look", None), ()), (("go", "north"), ()), (("pick", "key"), ()),
+                  (("go", "north"), ()), (("inventory", None), ()), (("go", "east"), ()), (("look", None), ())]
+        with mock.patch("fuzz.check_invariants", armory_is_forbidden):
+            self.assertEqual(fuzz.run_stream(stream, 0), (5, "reached the armory"))
+            minimal = fuzz.minimize(stream, 0, "reached the armory")
+        self.assertEqual([command for command, answers in minimal],
+                         [("go", "north"), ("go", "north"), ("go", "east")])
+
+
+def snapshot(game):
+    rooms = tuple((tuple(room.item_ids), tuple((soldier.name, soldier.health) for soldier in room.soldiers),
+                   tuple(room.exits)) for room in game.rooms.values())
+    player = game.player
+    return (player.current_room.id, player.health, player.max_health, player.has_shield,
+            tuple(player.backpack.item_ids), player.backpack.capacity, game.dragon.health,
+            game.scheduler.tick, rooms)
+
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        self.ui = ScriptedUI()
+        self.game = Game(self.ui, log_file=None)
+
+    def test_undo_move_and_pick_up(self):
+        self.game.process_command(("go", "north"))
+        self.game.process_command(("go", "north"))
+        before = snapshot(self.game)
+        self.game.process_command(("pick", "health bag"))
+        self.assertIn("health bag", self.game.player.backpack.contents)
+        self.game.process_command(("undo", None))
+        self.assertEqual(snapshot(self.game), before)
+        self.assertIn("health bag", self.game.dining_room.get_room_items())
+        self.game.process_command(("redo", None))
+        self.assertIn("health bag", self.game.player.backpack.contents)
+        self.game.process_command(("rewind", "3"))
+        self.assertIs(self.game.player.current_room, self.game.outside)
+
+    def test_rewind_restores_every_turn(self):
+        rng = random.Random(5)
+        stream = fuzz.generate_stream(rng, 60)
+        random.seed(5)
+        states = [snapshot(self.game)]
+        for command, answers in stream:
+            self.ui.answers.extend(answers)
+            self.game.process_command(command)
+            self.ui.answers.clear()
+            states.append(snapshot(self.game))
+        for turns in (1, 7, 20):
+            self.game.process_command(("rewind", str(turns)))
+            states = states[:-turns]
+            self.assertEqual(snapshot(self.game), states[-1])
+        self.game.process_command(("redo", None))
+        self.game.process_command(("undo", None))
+        self.assertEqual(snapshot(self.game), states[-1])
+
+    def test_undo_keeps_other_players_changes(self):
+        world = load_world(world_image.open_world_image())
+        games = [Game(ScriptedUI(), log_file=None, world=world) for _ in range(2)]
+        for game in games:
+            game.player.current_room = world["dining_room"]
+        games[0].process_command(("pick", "health bag"))
+        games[1].process_command(("pick", "health drink"))
+        games[0].process_command(("undo", None))
+        self.assertEqual(world["dining_room"].get_room_items(), ["health bag"])
+        self.assertEqual(games[1].player.backpack.contents, ["health drink"])
+
+    def test_history_is_limited(self):
+        game = Game(ScriptedUI(), log_file=None, history_limit=2)
+        for _ in range(3):
+            game.process_command(("go", "north"))
+        self.assertEqual(len(game.history), 2)
+
+    def test_no_undo_on_a_shard(self):
+        game = Game()
+        world_image.open_world_image()
+        shard = Shard([game.outside.id, game.entrance_hall.id])
+        shard.handle(("join", 1, game.get_state(), game.outside.id))
+        shard.handle(("command", 1, ("go", "north"), ()))
+        _, _, output, _ = shard.handle(("command", 1, ("undo", None), ()))
+        self.assertIn("Time cannot be turned back here.", output)
+
+
+class TestColdStart(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "castle.world")
+
+    def tearDown(self):
+        world_image._templates.pop(self.path, None)
+        image = world_image._images.pop(self.path, None)
+        if image is not None:
+            image.close()
+        self.directory.cleanup()
+
+    def test_image_matches_built_world(self):
+        image = world_image.open_world_image(self.path)
+        self.assertTrue(os.path.exists(self.path))
+        self.assertIs(world_image.open_world_image(self.path), image)
+        game = Game(ScriptedUI(), log_file=None)
+        game.__dict__.update(world_image.load_world(image))
+        self.assertEqual(snapshot(game), snapshot(Game(ScriptedUI(), log_file=None)))
+        self.assertIsNot(world_image.load_world(image)["garden"], game.garden)
+
+    def test_cold_start_game_plays(self):
+        game = Game(ScriptedUI(), log_file=None, cold_start=True)
+        game.process_command(("go", "north"))
+        self.assertIs(game.player.current_room, game.entrance_hall)
+
+    def test_stale_or_truncated_image_is_rebuilt(self):
+        world_image.build_world_image(self.path)
+        with mock.patch("world_image.source_stamp", return_value=0):
+            with self.assertRaises(WorldImageError):
+                WorldImage(self.path, world_image.source_stamp())
+            stale = world_image.open_world_image(self.path)
+            self.assertEqual(stale.source, 0)
+            stale.close()
+        del world_image._images[self.path]
+        with open(self.path, "r+b") as image:
+            image.seek(-1, os.SEEK_END)
+            image.write(b"!")
+        with self.assertRaises(WorldImageError):
+            WorldImage(self.path)
+        with open(self.path, "r+b") as image:
+            image.truncate(os.path.getsize(self.path) - 1)
+        image = world_image.open_world_image(self.path)
+        self.assertEqual(image.source, world_image.source_stamp())
+        self.assertEqual(len(image._map), os.path.getsize(self.path))
+
+    def test_cold_starts_copy_the_rooms(self):
+        first = world_image.cold_world(self.path)
+        second = world_image.cold_world(self.path)
+        self.assertIsNot(first["dining_room"], second["dining_room"])
+        self.assertIs(first["dining_room"].exits["east"], first["armory"])
+        first["dining_room"].remove_room_item("health bag")
+        first["garden"].soldiers[0].take_damage(10)
+        self.assertIn("health bag", second["dining_room"].get_room_items())
+        self.assertEqual(second["garden"].soldiers[0].health, 50)
+        game = Game(ScriptedUI(), log_file=None)
+        game.__dict__.update(world_image.cold_world(self.path))
+        self.assertEqual(snapshot(game), snapshot(Game(ScriptedUI(), log_file=None)))
+
+    def test_log_file_is_left_alone_until_first_event(self):
+        log_file = os.path.join(self.directory.name, "game_log.txt")
+        with open(log_file, "w") as log:
+            log.write("Previous game.\n")
+        game = Game(ScriptedUI(), log_file)
+        with open(log_file) as log:
+            self.assertEqual(log.read(), "Previous game.\n")
+        game.log("Game started.")
+        game.log("Player quit the game.")
+        with open(log_file) as log:
+            self.assertEqual(log.read(), "Game started.\nPlayer quit the game.\n")
+
+
+class FixedDice:
+    """Stands in for every random draw, always picking the same position of the range."""
+
+    def __init__(self, position):
+        self.position = position
+
+    def choice(self, options):
+        return options[self.position % len(options)]
+
+    def randint(self, low, high):
+        return low + self.position % (high - low + 1)
+
+    def integers(self, low, high, size):
+        return numpy.broadcast_to(low + self.position % (numpy.asarray(high) - low), size)
+
+
+QUEST = [("go", "north"), ("go", "north"), ("pick", "health bag"), ("pick", "health drink"), ("go", "east"),
+         ("pick", "sword"), ("pick", "shield"), ("go", "downstairs"), ("pick", "key"), ("go", "upstairs"),
+         ("go", "west"), ("go", "south"), ("go", "east"), ("fight", "soldiers"), ("pick", "magic scroll"),
+         ("go", "upstairs"), ("go", "north"), ("go", "east"), ("fight", None)]
+
+
+@unittest.skipUnless(numpy, "numpy is not installed")
+class TestVectorGame(unittest.TestCase):
+    def vector_state(self, batch, index):
+        alive = batch.soldier_health[index] > 0
+        return (batch.room_names[batch.room[index]], int(batch.health[index]), int(batch.max_health[index]),
+                bool(batch.has_shield[index]), int(batch.capacity[index]), batch.carried[index].tolist(),
+                batch.room_items[index].tolist(), int(batch.dragon_health[index]),
+                batch.soldier_health[index].tolist(),
+                {name: batch.room_names[room] for name, room, up in
+                 zip(batch.soldier_names, batch.soldier_room[index], alive) if up})
+
+    def game_state(self, batch, game, soldiers):
+        def counts(item_ids):
+            return [list(item_ids).count(item_id) for item_id in range(len(batch.item_names))]
+
+        player = game.player
+        return (player.current_room.name, player.health, player.max_health, player.has_shield,
+                player.backpack.capacity, counts(player.backpack.item_ids),
+                [counts(room.item_ids) for room in game.rooms.values()], game.dragon.health,
+                [soldiers[name].health for name in batch.soldier_names],
+                {soldier.name: room.name for room in game.rooms.values() for soldier in room.soldiers})
+
+    def test_matches_object_games(self):
+        streams = []
+        stream_rng = random.Random(5)
+        for index in range(24):
+            batch = VectorGame(1)
+            commands = [command for command in batch.commands if command != ("quit", None)]
+            stream = [stream_rng.choice(commands) for _ in range(60)]
+            if index % 4 == 2:
+                stream = [command for command in QUEST if command != ("pick", "shield")] + stream
+            elif index % 2 == 0:
+                stream = QUEST + stream
+            streams.append([batch.commands.index(command) for command in stream])
+
+        for policy in (attack_policy, cautious_policy):
+            for position in range(3):
+                dice = FixedDice(position)
+                batch = VectorGame(len(streams), policy=policy, rng=dice)
+                games = []
+                soldiers = []
+                for index in range(len(streams)):
+                    game = Game(ScriptedUI(default="yes"), log_file=None)
+                    game.ask_combat_action = policy
+                    game.combat.rng = dice
+                    if index % 4 == 2:
+                        # Some knights start wounded and without a shield, so they heal in fights and can lose them
+                        game.player.health = batch.health[index] = 25
+                    games.append(game)
+                    soldiers.append({soldier.name: soldier for room in game.rooms.values()
+                                     for soldier in room.soldiers})
+                outcomes = numpy.zeros(len(streams))
+                with mock.patch("random.choice", dice.choice), mock.patch("builtins.print"):
+                    for turn in range(len(streams[-2])):
+                        actions = [stream[turn] if turn < len(stream) else 0 for stream in streams]
+                        playing = ~batch.done
+                        _, rewards, _ = batch.step(actions)
+                        outcomes += rewards
+                        for index in numpy.flatnonzero(playing):
+                            game = games[index]
+                            game.process_command(batch.commands[actions[index]])
+                            self.assertEqual(self.vector_state(batch, index),
+                                             self.game_state(batch, game, soldiers[index]),
+                                             f"game {index}, turn {turn}, {policy.__name__}, dice {position}")
+                self.assertEqual(outcomes[0], 1.0)
+                if policy is attack_policy:
+                    self.assertIn(-1.0, outcomes)
+
+    def test_no_rewards_for_a_lost_fight(self):
+        batch = VectorGame(1, rng=FixedDice(SOLDIER_REWARDS.index("heal")))
+        garden = batch.room_names.index("garden")
+        batch.room[:] = batch.soldier_room[:] = garden
+        batch.health[:] = 25
+        _, rewards, done = batch.step([batch.commands.index(("fight", "soldiers"))])
+        self.assertEqual(batch.soldier_health[0].tolist(), [0, 50])
+        self.assertEqual(batch.health[0], 0)
+        self.assertEqual(rewards[0], -1.0)
+        self.assertTrue(done[0])
+
+    def test_step_reports_win(self):
+        batch = VectorGame(2, rng=FixedDice(0))
+        batch.has_shield[:] = True
+        rewards = None
+        for command in QUEST:
+            observations, rewards, done = batch.step([batch.commands.index(command)] * 2)
+        self.assertEqual(rewards.tolist(), [1.0, 1.0])
+        self.assertTrue(done.all())
+        self.assertEqual(observations[:, batch.observation_fields().index("dragon health")].tolist(), [0, 0])
+        batch.reset([1])
+        self.assertEqual(batch.done.tolist(), [True, False])
+        self.assertEqual(batch.room[1], batch.start_room)
+
+
 class TestGame(unittest.TestCase):
     def setUp(self):
         self.game = Game()
@@ -84,9 +714,24 @@ class TestGame(unittest.TestCase):
     def test_fight_soldier(self):
         self.game.player.current_room = self.game.garden
         self.assertIn("Soldier in the Garden", [soldier.name for soldier in self.game.garden.get_soldiers()])
-        self.game.do_fight_soldier_command()
+        with mock.patch("builtins.input", return_value="attack"):
+            self.game.do_fight_soldier_command()
         self.assertEqual(len(self.game.garden.get_soldiers()), 0)
 
+    def test_no_rewards_for_a_lost_fight(self):
+        garden = self.game.garden
+        for soldier in list(garden.get_soldiers()):
+            garden.remove_soldier(soldier)
+        garden.add_soldier(Soldier("Weak", 30, 1))
+        garden.add_soldier(Soldier("Brute", 500, 200))
+        self.game.player.current_room = garden
+        self.game.ui = self.game.combat.ui = ScriptedUI()
+        with mock.patch("random.choice", return_value="heal"):
+            self.game.do_fight_soldier_command()
+        self.assertIn("You have been defeated!", self.game.ui.lines)
+        self.assertEqual(self.game.player.health, 0)
+        self.assertNotIn("You are rewarded with a full heal!", self.game.ui.lines)
+
     def test_pick_item(self):
         self.game.player.current_room = self.game.armory
         self.assertIn("sword", self.game.armory.get_room_items())
@@ -99,6 +744,46 @@ class TestGame(unittest.TestCase):
         self.game.do_solve_command()
         self.assertIsNotNone(self.game.library.get_exit("secret", self.game.player.backpack.contents))
 
+    def test_fight_dragon(self):
+        self.game.player.current_room = self.game.dragons_lair
+        self.game.player.backpack.add_item("sword")
+        self.game.player.backpack.add_item("magic scroll")
+        with mock.patch("builtins.input", return_value="attack"):
+            self.assertTrue(self.game.do_fight_command())
+        self.assertFalse(self.game.dragon.is_alive())
+
+    def test_state_round_trip(self):
+        self.game.player.current_room = self.game.armory
+        self.game.player.backpack.add_item("sword")
+        self.game.player.equip_shield()
+        other = Game()
+        other.set_state(self.game.get_state())
+        self.assertIs(other.player.current_room, other.armory)
+        self.assertEqual(other.player.backpack.contents, ["sword"])
+        self.assertEqual(other.player.capabilities, self.game.player.capabilities)
+        self.assertEqual(other.player.max_health, 120)
+
+    def test_rooms_by_id(self):
+        for room_id, room in self.game.rooms.items():
+            self.assertEqual(room.id, room_id)
+        self.assertEqual(list(self.game.rooms), list(range(11)))
+        self.assertEqual(self.game.armory.name, "armory")
+
+    def test_rooms_with_the_same_name_keep_their_own_ids(self):
+        first, second = Room("Hall"), Room("Hall")
+        self.assertNotEqual(first.id, second.id)
+        self.assertEqual(first.name, second.name)
+        self.assertNotIn(first.id, self.game.rooms)
+
+    def test_locked_door(self):
+        self.game.player.current_room = self.game.tower_room
+        self.assertEqual(self.game.tower_room.get_exit("north", self.game.player.capabilities), "locked")
+        self.game.player.backpack.add_item("key")
+        self.assertIs(self.game.tower_room.get_exit("north", self.game.player.capabilities),
+                      self.game.queens_quarters)
+        self.game.player.backpack.remove_item("key")
+        self.assertEqual(self.game.tower_room.get_exit("north", self.game.player.capabilities), "locked")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,6 +1,7 @@
 """
 A simple text based User Interface (UI) for the Adventure World game.
 """
+from collections import deque
 
 
 class TextUI:
@@ -26,6 +27,13 @@ class TextUI:
             return command_word, second_word
         return None, None
 
+    def get_input(self):
+        """
+            Fetches an answer to a question (such as attack / heal) from the console.
+        :return: the answer in lower case
+        """
+        return input("> ").strip().lower()
+
     def print(self, text):
         """
             Displays text to the console.
@@ -33,3 +41,38 @@ class TextUI:
         :return: None
         """
         print(text)
+
+
+class ScriptedUI(TextUI):
+    """A UI for games driven by code: it keeps what is printed and answers questions from a script."""
+
+    def __init__(self, answers=(), default="attack"):
+        """
+        :param answers: Answers to give to questions, in order
+        :param default: The answer given once the script runs out
+        """
+        self.lines = []
+        self.answers = deque(answers)
+        self.default = default
+
+    def get_command(self):
+        """
+            Scripted games pass commands to process_command directly.
+        :return: a 2-tuple meaning no command
+        """
+        return None, None
+
+    def get_input(self):
+        """
+            Takes the next scripted answer.
+        :return: the answer in lower case
+        """
+        return self.answers.popleft() if self.answers else self.default
+
+    def print(self, text):
+        """
+            Keeps the text instead of displaying it.
+        :param text: Text to be displayed
+        :return: None
+        """
+        self.lines.append(text)
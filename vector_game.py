@@ -0,0 +1,390 @@
+"""
+Many games played in lockstep, for automated agents and balance tuning.
+
+VectorGame holds a batch of games as numpy arrays with one row per game
+(room, health, backpack counts, items in every room, dragon health, the
+soldiers' health and rooms) instead of a Game object each. step() plays one
+command in every game with a few array operations per kind of command,
+following the rules of Game.process_command: exits and locked doors,
+picking up, dropping and using items, fights with soldiers and the dragon
+turn by turn as CombatEngine resolves them, and the patrols and respawns
+the scheduler runs between commands. Undo, redo and rewind are not offered.
+
+The castle is read from a freshly built Game, so the rooms, items, soldiers
+and world events are always those of create_rooms. Running this module
+times a batch of games playing random commands.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from combat import HEALING_ITEMS, attack_policy, cautious_policy
+from game import (BAG_UPGRADE, DRAGON_FIGHT_REQUIRES, MAGIC_SCROLL, MAGIC_SWORD_DAMAGE, SOLDIER_REWARDS,
+                  SWORD_DAMAGE, Game)
+from player import SHIELD, SHIELD_BLOCK, SHIELD_HEALTH
+from registry import ITEMS
+from scheduler import Respawner, Roamer
+from text_ui import ScriptedUI
+
+# Kinds of command, the first column of VectorGame.commands
+GO, PICK, DROP, USE, FIGHT, FIGHT_SOLDIERS, LOOK, QUIT = range(8)
+
+# Reward for the step a game is won in, and for the step the player is defeated in
+WIN_REWARD = 1.0
+DEFEAT_REWARD = -1.0
+
+SHIELD_ID = SHIELD.bit_length() - 1
+ENHANCED_SWORD = ITEMS.intern("enhanced sword")
+
+
+class VectorGame:
+    """
+    This class steps a batch of games together. Actions are indexes into
+    commands, the (command_word, second_word) tuples process_command takes.
+    A game is over once the player quits, is defeated, or defeats the dragon;
+    later actions for it are ignored until it is reset.
+    """
+
+    def __init__(self, games, policy=attack_policy, accept_upgrades=True, rng=None):
+        """
+        :param games: How many games to play at once
+        :param policy: attack_policy or cautious_policy, the answer to every attack / heal question
+        :param accept_upgrades: The answer to every backpack upgrade offer
+        :param rng: A numpy Generator for the dragon's fire, the soldiers' rewards and patrols
+        """
+        if policy is not attack_policy and policy is not cautious_policy:
+            raise ValueError("policy must be attack_policy or cautious_policy")
+        self.games = games
+        self.cautious = policy is cautious_policy
+        self.accept_upgrades = accept_upgrades
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self._read_castle(Game(ScriptedUI(), log_file=None))
+        self.reset()
+
+    def _read_castle(self, template):
+        """
+        Turns a freshly built game into the tables the batch is played from.
+        :param template: The game to read
+        :return: None
+        """
+        rooms = list(template.rooms.values())
+        index = {room.id: position for position, room in enumerate(rooms)}
+        self.room_names = [room.name for room in rooms]
+        self.item_names = [ITEMS.name(item_id) for item_id in range(len(ITEMS))]
+        self.lair = index[template.dragons_lair.id]
+
+        directions = list(dict.fromkeys(direction for room in rooms for direction in room.exits))
+        self.exits = np.full((len(rooms), len(directions)), -1, dtype=np.int64)
+        self.lock_masks = np.zeros(len(rooms), dtype=np.int64)
+        patrol = [[] for _ in rooms]
+        self.start_items = np.zeros((len(rooms), len(self.item_names)), dtype=np.int16)
+        for room in rooms:
+            here = index[room.id]
+            for direction, neighbour in room.exits.items():
+                self.exits[here, directions.index(direction)] = index[neighbour.id]
+                if not neighbour.locked and not neighbour.has_dragon:
+                    patrol[here].append(index[neighbour.id])
+            if room.locked:
+                self.lock_masks[here] = room.lock_mask
+            for item_id in room.item_ids:
+                self.start_items[here, item_id] += 1
+        self.patrol_counts = np.array([len(rooms_out) for rooms_out in patrol], dtype=np.int64)
+        self.patrols = np.zeros((len(rooms), max(self.patrol_counts.max(), 1)), dtype=np.int64)
+        for here, rooms_out in enumerate(patrol):
+            self.patrols[here, :len(rooms_out)] = rooms_out
+
+        soldiers = [(soldier, index[room.id]) for room in rooms for soldier in room.soldiers]
+        self.soldier_names = [soldier.name for soldier, _ in soldiers]
+        self.soldier_health_max = np.array([soldier.max_health for soldier, _ in soldiers], dtype=np.int32)
+        self.soldier_damage = np.array([soldier.damage for soldier, _ in soldiers], dtype=np.int32)
+        self.soldier_hit = np.array([soldier.hit_damage for soldier, _ in soldiers], dtype=np.int32)
+        self.soldier_start = np.array([room for _, room in soldiers], dtype=np.int64)
+
+        # World events in the order the scheduler fires them: (first tick, interval, soldier or (room, item))
+        self.patrol_events = []
+        self.respawn_events = []
+        for due, _, event in sorted(template.scheduler._queue, key=lambda entry: entry[:2]):
+            action = event.action
+            if isinstance(action, Roamer):
+                soldier = [soldier for soldier, _ in soldiers].index(action.soldier)
+                self.patrol_events.append((due, action.interval, soldier))
+            elif isinstance(action, Respawner):
+                item = (index[action.room.id], ITEMS.lookup(action.item))
+                self.respawn_events.append((due, action.interval, item))
+
+        player, dragon = template.player, template.dragon
+        self.start_room = index[player.current_room.id]
+        self.start_health = player.health
+        self.start_capacity = player.backpack.capacity
+        self.dragon_health_max = dragon.health
+        self.dragon_hit = dragon.hit_damage
+        self.dragon_fire = (dragon.min_damage, dragon.max_damage)
+        self.heal_items = [(item_id, amount) for item_id, amount in HEALING_ITEMS]
+        self.item_bits = np.left_shift(1, np.arange(len(self.item_names), dtype=np.int64))
+
+        self.commands = [("go", direction) for direction in directions]
+        self.commands += [("pick", item) for item in self.item_names]
+        self.commands += [("drop", item) for item in self.item_names]
+        self.commands += [("use", ITEMS.name(item_id)) for item_id, _ in HEALING_ITEMS]
+        self.commands += [("fight", None), ("fight", "soldiers"), ("look", None), ("quit", None)]
+        kinds = {("fight", "soldiers"): FIGHT_SOLDIERS, ("fight", None): FIGHT, ("look", None): LOOK,
+                 ("quit", None): QUIT}
+        words = {"go": GO, "pick": PICK, "drop": DROP, "use": USE}
+        self.command_kinds = np.array([kinds[command] if command in kinds else words[command[0]]
+                                       for command in self.commands])
+        self.command_args = np.array([directions.index(second) if word == "go"
+                                      else ITEMS.lookup(second) if word in ("pick", "drop", "use") else 0
+                                      for word, second in self.commands])
+
+    def reset(self, games=None):
+        """
+        Starts games again from the beginning.
+        :param games: Indexes or a mask of the games to reset, all of them by default
+        :return: The observations of every game
+        """
+        if games is None:
+            count = self.games
+            self.room = np.full(count, self.start_room, dtype=np.int64)
+            self.health = np.full(count, self.start_health, dtype=np.int32)
+            self.max_health = np.full(count, self.start_health, dtype=np.int32)
+            self.has_shield = np.zeros(count, dtype=bool)
+            self.capacity = np.full(count, self.start_capacity, dtype=np.int32)
+            self.carried = np.zeros((count, len(self.item_names)), dtype=np.int16)
+            self.room_items = np.repeat(self.start_items[None], count, axis=0)
+            self.dragon_health = np.full(count, self.dragon_health_max, dtype=np.int32)
+            self.soldier_health = np.repeat(self.soldier_health_max[None], count, axis=0)
+            self.soldier_room = np.repeat(self.soldier_start[None], count, axis=0)
+            self.soldier_arrival = np.repeat(np.arange(len(self.soldier_names))[None], count, axis=0)
+            self.tick = np.zeros(count, dtype=np.int64)
+            self.done = np.zeros(count, dtype=bool)
+            self._arrivals = len(self.soldier_names)   #stamps the order soldiers entered their rooms in
+            return self.observe()
+        games = np.flatnonzero(games) if np.asarray(games).dtype == bool else np.asarray(games)
+        self.room[games] = self.start_room
+        self.health[games] = self.start_health
+        self.max_health[games] = self.start_health
+        self.has_shield[games] = False
+        self.capacity[games] = self.start_capacity
+        self.carried[games] = 0
+        self.room_items[games] = self.start_items
+        self.dragon_health[games] = self.dragon_health_max
+        self.soldier_health[games] = self.soldier_health_max
+        self.soldier_room[games] = self.soldier_start
+        self.soldier_arrival[games] = np.arange(len(self.soldier_names))
+        self.tick[games] = 0
+        self.done[games] = False
+        return self.observe()
+
+    def observation_fields(self):
+        """
+        :return: The names of the columns of an observation
+        """
+        return (["room", "health", "max health", "shield", "capacity", "dragon health", "soldiers here"]
+                + [f"carrying {item}" for item in self.item_names]
+                + [f"here {item}" for item in self.item_names])
+
+    def observe(self):
+        """
+        :return: An array with a row for every game, with the columns of observation_fields()
+        """
+        games = np.arange(self.games)
+        soldiers_here = ((self.soldier_room == self.room[:, None]) & (self.soldier_health > 0)).sum(axis=1)
+        return np.column_stack([self.room, self.health, self.max_health, self.has_shield, self.capacity,
+                                self.dragon_health, soldiers_here, self.carried,
+                                self.room_items[games, self.room]]).astype(np.int32)
+
+    def step(self, actions):
+        """
+        Plays one command in every game.
+        :param actions: An index into commands for every game
+        :return: (observations, rewards, done), each with a row for every game
+        """
+        actions = np.asarray(actions)
+        kinds = np.where(self.done, LOOK, self.command_kinds[actions])
+        args = self.command_args[actions]
+        for kind, handler in ((GO, self._go), (PICK, self._pick), (DROP, self._drop), (USE, self._use),
+                              (FIGHT, self._fight_dragon), (FIGHT_SOLDIERS, self._fight_soldiers)):
+            games = np.flatnonzero(kinds == kind)
+            if games.size:
+                handler(games, args[games])
+
+        playing = ~self.done
+        quitting = playing & (kinds == QUIT)
+        self._advance(np.flatnonzero(playing & ~quitting))
+        won = playing & (self.dragon_health == 0)
+        defeated = playing & ~won & (self.health == 0)
+        rewards = np.zeros(self.games, dtype=np.float32)
+        rewards[won] = WIN_REWARD
+        rewards[defeated] = DEFEAT_REWARD
+        self.done |= quitting | won | defeated
+        return self.observe(), rewards, self.done.copy()
+
+    def _capabilities(self, games):
+        """
+        :return: The capability mask of the player in each of the games, as Player.capabilities
+        """
+        mask = (self.carried[games] > 0) @ self.item_bits
+        return mask | np.where(self.has_shield[games], SHIELD, 0)
+
+    def _heal(self, games, amounts):
+        self.health[games] = np.minimum(self.health[games] + amounts, self.max_health[games])
+
+    def _take_damage(self, games, damage):
+        damage = np.maximum(damage - np.where(self.has_shield[games], SHIELD_BLOCK, 0), 0)
+        self.health[games] = np.maximum(self.health[games] - damage, 0)
+
+    def _go(self, games, directions):
+        rooms = self.exits[self.room[games], directions]
+        through = rooms >= 0
+        through[through] = self.lock_masks[rooms[through]] & ~self._capabilities(games[through]) == 0
+        self.room[games[through]] = rooms[through]
+
+    def _pick(self, games, items):
+        rooms = self.room[games]
+        found = self.room_items[games, rooms, items] > 0
+        shield = found & (items == SHIELD_ID)
+        # Picking up a second shield uses it up without equipping it again
+        equip = games[shield & ~self.has_shield[games]]
+        self.has_shield[equip] = True
+        self.max_health[equip] += SHIELD_HEALTH
+        self.health[equip] = self.max_health[equip]
+        taken = shield | found & (items != SHIELD_ID) & (self.carried[games].sum(axis=1) < self.capacity[games])
+        self.room_items[games[taken], rooms[taken], items[taken]] -= 1
+        carried = taken & ~shield
+        self.carried[games[carried], items[carried]] += 1
+
+    def _drop(self, games, items):
+        carried = self.carried[games, items] > 0
+        games, items = games[carried], items[carried]
+        self.carried[games, items] -= 1
+        self.room_items[games, self.room[games], items] += 1
+
+    def _use(self, games, items):
+        for item_id, amount in self.heal_items:
+            using = games[(items == item_id) & (self.carried[games, item_id] > 0)]
+            self.carried[using, item_id] -= 1
+            self._heal(using, amount)
+
+    def _choose_heal(self, games):
+        """
+        :return: Which of the games the policy heals in this turn
+        """
+        if not self.cautious:
+            return np.zeros(games.size, dtype=bool)
+        carrying = (self.carried[games][:, [item_id for item_id, _ in self.heal_items]] > 0).any(axis=1)
+        return (self.health[games] * 3 < self.max_health[games]) & carrying
+
+    def _heal_from_backpack(self, games):
+        """Uses the first healing item carried in each of the games, as CombatEngine.heal."""
+        for item_id, amount in self.heal_items:
+            using = games[self.carried[games, item_id] > 0]
+            self.carried[using, item_id] -= 1
+            self._heal(using, amount)
+            games = np.setdiff1d(games, using, assume_unique=True)
+
+    def _fight_dragon(self, games, _):
+        capabilities = self._capabilities(games)
+        armed = (self.room[games] == self.lair) & (capabilities & DRAGON_FIGHT_REQUIRES == DRAGON_FIGHT_REQUIRES)
+        games, capabilities = games[armed], capabilities[armed]
+        first_strike = np.where(capabilities & MAGIC_SCROLL, MAGIC_SWORD_DAMAGE, SWORD_DAMAGE)
+        self.dragon_health[games] = np.maximum(self.dragon_health[games] - first_strike, 0)
+
+        games = games[(self.dragon_health[games] > 0) & (self.health[games] > 0)]
+        while games.size:
+            healing = self._choose_heal(games)
+            self._heal_from_backpack(games[healing])
+            attacking = games[~healing]
+            self.dragon_health[attacking] = np.maximum(self.dragon_health[attacking] - self.dragon_hit, 0)
+            games = games[self.dragon_health[games] > 0]
+            low, high = self.dragon_fire
+            self._take_damage(games, self.rng.integers(low, high + 1, size=games.size))
+            games = games[self.health[games] > 0]
+
+    def _fight_soldiers(self, games, _):
+        here = (self.soldier_room[games] == self.room[games, None]) & (self.soldier_health[games] > 0)
+        fighting = here.any(axis=1)
+        games, standing = games[fighting], here[fighting]
+        # Soldiers are fought in the order they came into the room
+        order = np.argsort(np.where(standing, self.soldier_arrival[games], np.iinfo(np.int64).max),
+                           axis=1, kind="stable")
+        defeated = np.zeros(games.size, dtype=np.int64)
+        rows = np.arange(games.size)
+        while rows.size:
+            healing = self._choose_heal(games[rows])
+            self._heal_from_backpack(games[rows[healing]])
+            attacking = rows[~healing]
+            target = order[attacking, defeated[attacking]]
+            health = np.maximum(self.soldier_health[games[attacking], target] - self.soldier_hit[target], 0)
+            self.soldier_health[games[attacking], target] = health
+            killed = attacking[health == 0]
+            standing[killed, target[health == 0]] = False
+            defeated[killed] += 1
+            rows = rows[standing[rows].any(axis=1)]
+            # Every soldier still standing strikes, each blow blunted by the shield on its own
+            striking = games[rows]
+            blows = np.maximum(self.soldier_damage - np.where(self.has_shield[striking], SHIELD_BLOCK, 0)[:, None], 0)
+            self.health[striking] = np.maximum(self.health[striking] - (standing[rows] * blows).sum(axis=1), 0)
+            rows = rows[self.health[striking] > 0]
+
+        # One reward for every soldier defeated, in turn, if the player won the fight
+        won = self.health[games] > 0
+        for turn in range(1, defeated.max(initial=0) + 1):
+            winners = games[won & (defeated >= turn)]
+            rewards = self.rng.integers(0, len(SOLDIER_REWARDS), size=winners.size)
+            if self.accept_upgrades:
+                upgrade = winners[rewards == SOLDIER_REWARDS.index("bag_upgrade")]
+                self.capacity[upgrade] += BAG_UPGRADE
+            healed = winners[rewards == SOLDIER_REWARDS.index("heal")]
+            self.health[healed] = self.max_health[healed]
+            armed = winners[rewards == SOLDIER_REWARDS.index("sword")]
+            armed = armed[self.carried[armed].sum(axis=1) < self.capacity[armed]]
+            self.carried[armed, ENHANCED_SWORD] += 1
+
+    def _advance(self, games):
+        """Moves the world on a tick in each of the games, as Scheduler.advance with create_rooms' events."""
+        self.tick[games] += 1
+        ticks = self.tick[games]
+        for first, interval, soldier in self.patrol_events:
+            moving = games[(ticks >= first) & ((ticks - first) % interval == 0)
+                           & (self.soldier_health[games, soldier] > 0)]
+            rooms = self.soldier_room[moving, soldier]
+            counts = self.patrol_counts[rooms]
+            choice = self.rng.integers(0, np.maximum(counts, 1), size=moving.size)
+            moving, rooms, choice = moving[counts > 0], rooms[counts > 0], choice[counts > 0]
+            self.soldier_room[moving, soldier] = self.patrols[rooms, choice]
+            self.soldier_arrival[moving, soldier] = self._arrivals
+            self._arrivals += 1
+        for first, interval, (room, item) in self.respawn_events:
+            due = games[(ticks >= first) & ((ticks - first) % interval == 0)]
+            self.room_items[due, room, item] = np.maximum(self.room_items[due, room, item], 1)
+
+
+def main():
+    """Times a batch of games playing random commands."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    batch = VectorGame(args.games, policy=cautious_policy, rng=rng)
+    quit_action = batch.commands.index(("quit", None))
+    # Random commands other than quit
+    choices = np.delete(np.arange(len(batch.commands)), quit_action)
+    finished = 0
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        _, rewards, done = batch.step(rng.choice(choices, size=args.games))
+        finished += int(done.sum())
+        batch.reset(done)
+    elapsed = time.perf_counter() - start
+    total = args.games * args.steps
+    print(f"{args.games} games, {args.steps} steps: {total} commands in {elapsed:.2f}s "
+          f"({total / elapsed:.0f} commands/s, {elapsed / args.steps * 1000:.2f} ms per step), "
+          f"{finished} games finished")
+
+
+if __name__ == "__main__":
+    main()
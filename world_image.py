@@ -0,0 +1,461 @@
+"""
+Read-only world image: the castle's rooms, exits, starting items, soldiers
+and text written once to a file with a fixed layout, so worker processes can
+mmap it, read rooms through small views and decode only the rooms they
+build Room objects for.
+
+Layout (little endian):
+    header      magic, version, source stamp, checksum of the rest of the
+                file, then the count and file offset of each table
+    rooms       one ROOM record per room
+    exits       one EXIT record per exit, grouped by room
+    refs        string numbers of starting items and key items, grouped by room
+    soldiers    one SOLDIER record per soldier, grouped by room
+    string index (offset, length) of each string in the string data
+    string data  UTF-8 text
+
+Items are stored by name and interned when rooms are built, so the image
+does not depend on the item IDs of the process that wrote it.
+
+The castle's own image lives under __pycache__ and is stamped with the
+sizes and modification times of the sources that define the world, as .pyc
+files are; open_world_image rebuilds it when they change. Like a .pyc, an
+image whose header, size and stamp match is trusted without reading the
+rest of it, so opening it costs the same however big the world is.
+
+Games started with cold_start do not run create_rooms: the first one in a
+process builds the rooms from the image, and every later one copies those
+rooms with copy_world, which skips the Room constructors, the decoding and
+the interning.
+"""
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from registry import ITEMS
+from room import Room, RoomStub
+from soldier import Soldier
+
+MAGIC = b"QFTQ"
+VERSION = 2
+
+HEADER = struct.Struct("<4sHH14I")
+ROOM = struct.Struct("<iiii9I")  #attribute, name, description, clue, flags, exits, items, keys and soldiers (start, count)
+EXIT = struct.Struct("<iI")      #direction, room number
+REF = struct.Struct("<I")        #string number
+SOLDIER = struct.Struct("<Iii")  #name, health, damage
+STRING = struct.Struct("<II")    #offset into the string data, length
+
+LOCKED = 1
+HAS_DRAGON = 2
+HAS_QUEEN = 4
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+IMAGE_PATH = os.path.join(DIRECTORY, "__pycache__", "castle.world")
+
+# Source files whose changes change the castle or its image
+WORLD_SOURCES = ["game.py", "room.py", "soldier.py", "world_image.py"]
+
+# Images opened by open_world_image, by path, kept mapped for later games
+_images = {}
+# Worlds built from those images, by path, copied for every cold start
+_templates = {}
+
+
+class WorldImageError(Exception):
+    """Raised when a world image file is not valid."""
+
+
+def write_world_image(path, rooms, attributes=None, source=0):
+    """
+    Writes rooms to a world image file. The file is replaced atomically, so
+    processes that already have the old image mapped keep a consistent copy.
+    :param path: The file to write
+    :param rooms: The rooms to store, in the order they are numbered
+    :param attributes: A dictionary of the attribute names create_rooms gives rooms, to store with them
+    :param source: A stamp of what the world was built from, checked when the image is opened
+    :return: None
+    """
+    rooms = list(rooms)
+    numbers = {id(room): number for number, room in enumerate(rooms)}
+    names = {id(room): name for name, room in (attributes or {}).items()}
+    strings = {}
+
+    def string(text):
+        if text is None:
+            return -1
+        return strings.setdefault(text, len(strings))
+
+    room_records = []
+    exits = []
+    refs = []
+    soldiers = []
+    for room in rooms:
+        flags = (LOCKED if room.locked else 0) | (HAS_DRAGON if room.has_dragon else 0) \
+            | (HAS_QUEEN if room.has_queen else 0)
+        exit_start = len(exits)
+        for direction, neighbour in room.exits.items():
+            exits.append(EXIT.pack(string(direction), numbers[id(neighbour)]))
+        item_start = len(refs)
+        refs.extend(REF.pack(string(item)) for item in room.items)
+        key_start = len(refs)
+        refs.extend(REF.pack(string(key)) for key in room.key_items)
+        soldier_start = len(soldiers)
+        soldiers.extend(SOLDIER.pack(string(soldier.name), soldier.health, soldier.damage)
+                        for soldier in room.soldiers)
+        room_records.append(ROOM.pack(string(names.get(id(room))), string(room.name), string(room.description),
+                                      string(room.clue), flags, exit_start, len(exits) - exit_start,
+                                      item_start, key_start - item_start, key_start, len(refs) - key_start,
+                                      soldier_start, len(soldiers) - soldier_start))
+
+    data = bytearray()
+    index = []
+    for text in strings:
+        encoded = text.encode("utf-8")
+        index.append(STRING.pack(len(data), len(encoded)))
+        data += encoded
+
+    rooms_offset = HEADER.size
+    exits_offset = rooms_offset + ROOM.size * len(room_records)
+    refs_offset = exits_offset + EXIT.size * len(exits)
+    soldiers_offset = refs_offset + REF.size * len(refs)
+    index_offset = soldiers_offset + SOLDIER.size * len(soldiers)
+    data_offset = index_offset + STRING.size * len(index)
+    body = b"".join(room_records + exits + refs + soldiers + index) + data
+    header = HEADER.pack(MAGIC, VERSION, 0, source, zlib.crc32(body), len(room_records), rooms_offset,
+                         len(exits), exits_offset, len(refs), refs_offset, len(soldiers), soldiers_offset,
+                         len(index), index_offset, len(data), data_offset)
+
+    temporary = f"{path}.tmp{os.getpid()}"
+    with open(temporary, "wb") as image:
+        image.write(header)
+        image.write(body)
+    os.replace(temporary, path)
+
+
+class WorldImage:
+    """
+    A world image mapped into memory. Nothing is decoded up front: rooms are
+    read through RoomView objects, which unpack fields only when asked.
+    """
+
+    def __init__(self, path, source=None, verify=True):
+        """
+        :param path: The world image file
+        :param source: The stamp the image must have been written with, or None to accept any
+        :param verify: Whether to check the checksum too, which reads the whole file
+        """
+        with open(path, "rb") as image:
+            self._map = mmap.mmap(image.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._check(path, source, verify)
+        except WorldImageError:
+            self._map.close()
+            raise
+
+    def _check(self, path, source, verify):
+        if len(self._map) < HEADER.size:
+            raise WorldImageError(f"{path} is too short to be a world image.")
+        (magic, version, _, self.source, checksum, self.room_count, self._rooms, self.exit_count, self._exits,
+         self.ref_count, self._refs, self.soldier_count, self._soldiers, self.string_count, self._index,
+         data_size, self._data) = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise WorldImageError(f"{path} is not a version {VERSION} world image.")
+        if self._data + data_size != len(self._map):
+            raise WorldImageError(f"{path} is truncated.")
+        if source is not None and self.source != source:
+            raise WorldImageError(f"{path} was built from other sources.")
+        if verify and zlib.crc32(memoryview(self._map)[HEADER.size:]) != checksum:
+            raise WorldImageError(f"{path} is damaged.")
+
+    def string(self, number):
+        """
+        :param number: A string number from the image
+        :return: The text, or None for -1
+        """
+        if number < 0:
+            return None
+        offset, length = STRING.unpack_from(self._map, self._index + STRING.size * number)
+        start = self._data + offset
+        return self._map[start:start + length].decode("utf-8")
+
+    def room(self, number):
+        """
+        :param number: The room's number in the image
+        :return: A RoomView of the room
+        """
+        if not 0 <= number < self.room_count:
+            raise IndexError(number)
+        return RoomView(self, number)
+
+    def rooms(self):
+        """
+        :return: A view of every room, in order
+        """
+        return [RoomView(self, number) for number in range(self.room_count)]
+
+    def find_room(self, name):
+        """
+        :param name: The room's short name
+        :return: The RoomView of the room, or None
+        """
+        for number in range(self.room_count):
+            view = RoomView(self, number)
+            if view.name == name:
+                return view
+        return None
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RoomView:
+    """A read-only view of one room in a WorldImage."""
+    __slots__ = ("image", "number")
+
+    def __init__(self, image, number):
+        self.image = image
+        self.number = number
+
+    def _record(self):
+        return ROOM.unpack_from(self.image._map, self.image._rooms + ROOM.size * self.number)
+
+    def _refs(self, start, count):
+        image = self.image
+        offset = image._refs + REF.size * start
+        return [image.string(REF.unpack_from(image._map, offset + REF.size * n)[0]) for n in range(count)]
+
+    @property
+    def attribute(self):
+        """
+        :return: The attribute create_rooms keeps the room in, or None
+        """
+        return self.image.string(self._record()[0])
+
+    @property
+    def name(self):
+        return self.image.string(self._record()[1])
+
+    @property
+    def description(self):
+        return self.image.string(self._record()[2])
+
+    @property
+    def clue(self):
+        return self.image.string(self._record()[3])
+
+    @property
+    def locked(self):
+        return bool(self._record()[4] & LOCKED)
+
+    @property
+    def has_dragon(self):
+        return bool(self._record()[4] & HAS_DRAGON)
+
+    @property
+    def has_queen(self):
+        return bool(self._record()[4] & HAS_QUEEN)
+
+    @property
+    def exits(self):
+        """
+        :return: A dictionary of direction to room number
+        """
+        start, count = self._record()[5:7]
+        image = self.image
+        exits = {}
+        for n in range(start, start + count):
+            direction, number = EXIT.unpack_from(image._map, image._exits + EXIT.size * n)
+            exits[image.string(direction)] = number
+        return exits
+
+    def get_exit(self, direction):
+        """
+        :param direction: The direction to travel
+        :return: The RoomView the exit leads to, or None
+        """
+        number = self.exits.get(direction)
+        return None if number is None else RoomView(self.image, number)
+
+    @property
+    def items(self):
+        """
+        :return: The names of the items the room starts with
+        """
+        return self._refs(*self._record()[7:9])
+
+    @property
+    def key_items(self):
+        """
+        :return: The items needed to unlock the room
+        """
+        return self._refs(*self._record()[9:11])
+
+    @property
+    def soldiers(self):
+        """
+        :return: (name, health, damage) of every soldier the room starts with
+        """
+        start, count = self._record()[11:13]
+        image = self.image
+        soldiers = []
+        for n in range(start, start + count):
+            name, health, damage = SOLDIER.unpack_from(image._map, image._soldiers + SOLDIER.size * n)
+            soldiers.append((image.string(name), health, damage))
+        return soldiers
+
+
+def room_attributes(world):
+    """
+    :param world: An object create_rooms was run on
+    :return: A dictionary of the attribute names it keeps rooms in, to the rooms
+    """
+    return {name: value for name, value in vars(world).items() if isinstance(value, Room)}
+
+
+def load_world(image, numbers=None):
+    """
+    Builds rooms from a world image as create_rooms builds them. Rooms that
+    are not built are represented by RoomStubs where an exit or an attribute
+    leads to them. Only the rooms built are decoded; of the others, only
+    the attribute and what a stub needs are read.
+    :param image: The WorldImage
+    :param numbers: The numbers of the rooms to build, all of them by default
+    :return: A dictionary of the attributes create_rooms sets, with rooms
+        holding the rooms built by ID
+    """
+    numbers = range(image.room_count) if numbers is None else sorted(numbers)
+    rooms = {}
+    views = {}
+    for number in numbers:
+        view = views[number] = RoomView(image, number)
+        keys = view.key_items
+        room = Room(view.description, locked=view.locked, key_item=keys[0] if len(keys) == 1 else keys or None,
+                    clue=view.clue, name=view.name, room_id=number)
+        room.has_dragon = view.has_dragon
+        room.has_queen = view.has_queen
+        room.item_ids = array("H", [ITEMS.intern(item) for item in view.items])
+        room.soldiers = [Soldier(soldier_name, health=health, damage=damage)
+                         for soldier_name, health, damage in view.soldiers]
+        rooms[number] = room
+
+    stubs = {}
+
+    def lookup(number):
+        room = rooms.get(number)
+        if room is None:
+            room = stubs.get(number)
+            if room is None:
+                view = RoomView(image, number)
+                room = stubs[number] = RoomStub(number, view.name, view.locked, view.key_items)
+        return room
+
+    for number, room in rooms.items():
+        room.exits = {direction: lookup(neighbour) for direction, neighbour in views[number].exits.items()}
+    world = {}
+    for number in range(image.room_count):
+        attribute = RoomView(image, number).attribute
+        if attribute is not None:
+            world[attribute] = lookup(number)
+    world["rooms"] = rooms
+    return world
+
+
+def _copy(obj):
+    copied = object.__new__(type(obj))
+    copied.__dict__.update(obj.__dict__)
+    return copied
+
+
+def copy_world(world):
+    """
+    Copies a world load_world built. Rooms are copied attribute by attribute
+    without running their constructors, and only what a game changes (exits,
+    items and soldiers) gets new containers; RoomStubs are shared.
+    :param world: The dictionary load_world returned
+    :return: A dictionary in the same form, sharing nothing a game changes
+    """
+    rooms = {number: _copy(room) for number, room in world["rooms"].items()}
+    for room in rooms.values():
+        room.__dict__.update(exits={direction: rooms.get(neighbour.id, neighbour)
+                                    for direction, neighbour in room.exits.items()},
+                             item_ids=array("H", room.item_ids),
+                             soldiers=[_copy(soldier) for soldier in room.soldiers])
+    copied = {attribute: rooms.get(room.id, room) for attribute, room in world.items() if attribute != "rooms"}
+    copied["rooms"] = rooms
+    return copied
+
+
+def cold_world(path=IMAGE_PATH):
+    """
+    Builds the castle's rooms for a cold start. The image is decoded into
+    rooms once per process, and every call copies those rooms.
+    :param path: The image file
+    :return: A dictionary of the attributes create_rooms sets, or None if no image can be written there
+    """
+    template = _templates.get(path)
+    if template is None:
+        image = open_world_image(path)
+        if image is None:
+            return None
+        template = _templates[path] = load_world(image)
+    return copy_world(template)
+
+
+class _World:
+    """Holds the attributes create_rooms sets."""
+
+
+def source_stamp():
+    """
+    :return: A checksum of the Python version and the sources that define the castle
+    """
+    stamps = [sys.version]
+    for name in WORLD_SOURCES:
+        status = os.stat(os.path.join(DIRECTORY, name))
+        stamps.append(f"{name}:{status.st_size}:{status.st_mtime_ns}")
+    return zlib.crc32("\n".join(stamps).encode())
+
+
+def build_world_image(path=IMAGE_PATH):
+    """
+    Builds the castle with create_rooms and writes its image.
+    :param path: The image file
+    :return: None
+    """
+    from game import Game   #imported here because game imports this module
+
+    world = _World()
+    Game.create_rooms(world)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_world_image(path, world.rooms.values(), room_attributes(world), source_stamp())
+
+
+def open_world_image(path=IMAGE_PATH):
+    """
+    Maps the castle's image, rebuilding it first if it is missing, stale or truncated.
+    :param path: The image file
+    :return: The WorldImage, or None if no image can be written there
+    """
+    image = _images.get(path)
+    if image is None:
+        stamp = source_stamp()
+        try:
+            image = WorldImage(path, stamp, verify=False)
+        except (OSError, WorldImageError):
+            try:
+                build_world_image(path)
+                image = WorldImage(path, stamp, verify=False)
+            except (OSError, WorldImageError):
+                return None     #a read-only install still starts, it just builds the rooms each run
+        _images[path] = image
+    return image